@@ -19,9 +19,11 @@ import click
 
 from nck.writers import writers, Writer
 from nck.readers import readers, Reader
+from nck.stages import stages, Stage
 import nck.state_service as state
 from nck.streams.normalized_json_stream import NormalizedJSONStream
 from nck.streams.json_stream import JSONStream
+from nck.streams.stream import Stream
 
 
 @click.group(chain=True)
@@ -31,7 +33,10 @@ from nck.streams.json_stream import JSONStream
 @click.option("--normalize-keys", default=False,
               help="(Optional) If set to true, will normalize the output files keys, removing "
                    "white spaces and special characters.", type=bool)
-def app(state_service_name, state_service_host, state_service_port, normalize_keys):
+@click.option("--encoding-workers", default=1, type=int,
+              help="(Optional) Number of worker processes used to encode output stream records. "
+                   "Only worth it for very large streams.")
+def app(state_service_name, state_service_host, state_service_port, normalize_keys, encoding_workers):
     if (state_service_name or state_service_host) and not (
             state_service_name and state_service_host
     ):
@@ -41,12 +46,14 @@ def app(state_service_name, state_service_host, state_service_port, normalize_ke
 
 
 @app.resultcallback()
-def run(processors, state_service_name, state_service_host, state_service_port, normalize_keys):
+def run(processors, state_service_name, state_service_host, state_service_port, normalize_keys, encoding_workers=1):
     state.configure(state_service_name, state_service_host, state_service_port)
+    Stream.encoding_workers = encoding_workers
 
     processor_instances = [p() for p in processors]
 
     _readers = list(filter(lambda o: isinstance(o, Reader), processor_instances))
+    _stages = list(filter(lambda o: isinstance(o, Stage), processor_instances))
     _writers = list(filter(lambda o: isinstance(o, Writer), processor_instances))
 
     if len(_readers) < 1:
@@ -61,12 +68,17 @@ def run(processors, state_service_name, state_service_host, state_service_port,
     reader = _readers[0]
     # A stream should represent a full file!
     for stream in reader.read():
+        for stage in _stages:
+            stream = stage.process(stream)
         for writer in _writers:
             if normalize_keys and issubclass(stream.__class__, JSONStream):
                 writer.write(NormalizedJSONStream.create_from_stream(stream))
             else:
                 writer.write(stream)
 
+    for writer in _writers:
+        writer.close()
+
 
 def cli_entrypoint():
     build_commands()
@@ -80,6 +92,9 @@ def build_commands():
     for reader in readers:
         app.add_command(reader)
 
+    for stage in stages:
+        app.add_command(stage)
+
 
 if __name__ == "__main__":
     build_commands()
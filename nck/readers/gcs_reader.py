@@ -15,23 +15,80 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import io
+
 import click
 
 from google.cloud import storage
 from nck.commands.command import processor
 from nck.readers.objectstorage_reader import ObjectStorageReader
 from nck.utils.args import extract_args
+from nck.utils.file_reader import FileEnum
 from nck.helpers.google_base import GoogleBaseClass
+from nck.utils.buffers import RangeReader
 import urllib
 
+# Size of the byte ranges in which blobs are read while they are parsed
+STREAM_CHUNK_SIZE = 8 * 1024 * 1024
+
 
 @click.command(name="read_gcs")
 @click.option("--gcs-bucket", required=True)
 @click.option("--gcs-prefix", required=True, multiple=True)
-@click.option("--gcs-format", required=True, type=click.Choice(["csv", "gz"]))
+@click.option(
+    "--gcs-format", required=True, type=click.Choice([_format.lower() for _format in FileEnum.__members__])
+)
 @click.option("--gcs-dest-key-split", default=-1, type=int)
 @click.option("--gcs-csv-delimiter", default=",")
 @click.option("--gcs-csv-fieldnames", default=None)
+@click.option(
+    "--gcs-prefetch-objects",
+    default=0,
+    type=int,
+    help="Number of objects downloaded in advance, concurrently, while the current one is read",
+)
+@click.option(
+    "--gcs-download-slices",
+    default=1,
+    type=int,
+    help="Number of byte ranges of large objects downloaded concurrently",
+)
+@click.option(
+    "--gcs-slice-size-mb",
+    default=64,
+    type=int,
+    help="Size of the byte ranges of sliced downloads, in MB: only objects larger than it are sliced",
+)
+@click.option(
+    "--gcs-parse-workers",
+    default=1,
+    type=int,
+    help="Number of processes parsing CSV and NJSON objects in parallel, by blocks of lines",
+)
+@click.option(
+    "--gcs-time-ordered-keys",
+    is_flag=True,
+    default=False,
+    help="Keys sort in the same order as object timestamps (e.g. date-based paths): "
+    "skip the keys up to the last processed one as they are listed",
+)
+@click.option(
+    "--gcs-listing-index",
+    help="Local file in which the last processed key of each prefix is kept, "
+    "to list keys after it without a state service",
+)
+@click.option(
+    "--gcs-coalesce-max-bytes",
+    default=0,
+    type=int,
+    help="Maximum size of consecutive objects merged into a single stream, in bytes (0: no limit)",
+)
+@click.option(
+    "--gcs-coalesce-max-files",
+    default=0,
+    type=int,
+    help="Maximum number of consecutive objects merged into a single stream (0: no limit)",
+)
 @processor()
 def gcs(**kwargs):
     return GCSReader(**extract_args("gcs_", kwargs))
@@ -51,8 +108,13 @@ class GCSReader(ObjectStorageReader, GoogleBaseClass):
     def create_bucket(self, client, bucket):
         return client.bucket(bucket)
 
-    def list_objects(self, bucket, prefix):
-        return bucket.list_blobs(prefix=prefix)
+    def list_objects(self, bucket, prefix, start_after=None):
+        blobs = bucket.list_blobs(prefix=prefix)
+        if start_after:
+            # The pinned google-cloud-storage can't start listings at a key (start_offset):
+            # the whole prefix is listed, and the keys up to the last processed one are skipped
+            return (blob for blob in blobs if blob.name > start_after)
+        return blobs
 
     @staticmethod
     def get_timestamp(_object):
@@ -69,3 +131,19 @@ class GCSReader(ObjectStorageReader, GoogleBaseClass):
     @staticmethod
     def download_object_to_file(_object, temp):
         _object.download_to_file(temp)
+
+    @staticmethod
+    def get_size(_object):
+        return _object.size
+
+    @staticmethod
+    def download_range(_object, start, end):
+        # Ranges are read from the listed generation of the blob: if it is overwritten in the meantime,
+        # the download fails instead of mixing the content of both versions
+        blob = _object.bucket.blob(_object.name, generation=_object.generation)
+        # download_as_string ranges include their end
+        return blob.download_as_string(start=start, end=end - 1)
+
+    def open_object(self, _object):
+        raw = RangeReader(lambda start, end: self.download_range(_object, start, end), _object.size, STREAM_CHUNK_SIZE)
+        return io.BufferedReader(raw)
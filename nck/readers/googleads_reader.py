@@ -22,7 +22,6 @@ import re
 import csv
 import ast
 
-from io import StringIO
 from click import ClickException
 from googleads import adwords
 from googleads.oauth2 import GoogleRefreshTokenClient
@@ -33,6 +32,8 @@ from nck.utils.args import extract_args
 from nck.utils.retry import retry
 from nck.commands.command import processor
 from nck.streams.normalized_json_stream import NormalizedJSONStream
+from nck.streams.record_batch import RecordBatch
+from nck.utils.file_reader import batch_rows
 from nck.helpers.googleads_helper import (
     REPORT_TYPE_POSSIBLE_VALUES,
     DATE_RANGE_TYPE_POSSIBLE_VALUES,
@@ -344,27 +345,40 @@ class GoogleAdsReader(Reader):
         return video_campaigns_report
 
     def format_and_yield(self):
+        """
+            Yields the rows of each customer report as record batches, sharing the report fields.
+        """
         report_definition = self.get_report_definition()
         stream_reader = codecs.getreader(ENCODING)
         if self.filter_on_video_campaigns:
             video_campaign_ids = self.list_video_campaign_ids()
+            campaign_id_index = list(self.fields).index("CampaignId")
 
         for googleads_account_id in self.client_customer_ids:
             customer_report = self.fetch_report_from_gads_client_customer_obj(
                 report_definition, googleads_account_id
             )
             if customer_report:
-                customer_report = stream_reader(customer_report)
-                for row in customer_report:
-                    reader = csv.DictReader(StringIO(row), self.fields)
-                    for row in reader:
-                        if self.include_client_customer_id:
-                            row["AccountId"] = googleads_account_id
-                        if self.filter_on_video_campaigns:
-                            if row["CampaignId"] in video_campaign_ids:
-                                yield row
-                        else:
-                            yield row
+                rows = csv.reader(stream_reader(customer_report))
+                if self.filter_on_video_campaigns:
+                    rows = (
+                        row
+                        for row in rows
+                        if len(row) > campaign_id_index and row[campaign_id_index] in video_campaign_ids
+                    )
+                for batch in batch_rows(rows, self.fields):
+                    if self.include_client_customer_id:
+                        batch = self.add_account_id(batch, googleads_account_id)
+                    yield batch
+
+    @staticmethod
+    def add_account_id(batch, googleads_account_id):
+        if isinstance(batch, RecordBatch):
+            return RecordBatch(
+                [*batch.headers, "AccountId"], [(*row, googleads_account_id) for row in batch.rows]
+            )
+        batch["AccountId"] = googleads_account_id
+        return batch
 
     def read(self):
         if self.manager_id:
@@ -16,19 +16,28 @@
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 import config
+import os
 import tempfile
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import tee
 
 from nck.readers.reader import Reader
 from nck.streams.normalized_json_stream import NormalizedJSONStream
 from nck.utils.file_reader import FileEnum
+from nck.utils.retry import retry
+from nck.utils.listing_index import ListingIndex
+
+# Maximum number of prefixes listed concurrently
+MAX_LISTING_WORKERS = 8
 
 
 def find_reader(_format, kwargs):
     _format = _format.upper()
     if _format in FileEnum.__members__:
         r = getattr(FileEnum, _format).value
-        _reader = r(**kwargs).get_csv_reader()
+        _reader = r(**kwargs)
     else:
         raise NotImplementedError(
             f"The file format {str(_format)} has not been implemented for reading yet."
@@ -54,7 +63,20 @@ def _object_as_old_as_most_recently_ingested_file(max_timestamp, _object_timesta
 
 class ObjectStorageReader(Reader):
     def __init__(
-        self, bucket, prefix, file_format, dest_key_split, platform=None, **kwargs
+        self,
+        bucket,
+        prefix,
+        file_format,
+        dest_key_split,
+        platform=None,
+        prefetch_objects=0,
+        download_slices=1,
+        slice_size_mb=64,
+        time_ordered_keys=False,
+        listing_index=None,
+        coalesce_max_bytes=0,
+        coalesce_max_files=0,
+        **kwargs,
     ):
         self._client = self.create_client(config)
         self._bucket = self.create_bucket(self._client, bucket)
@@ -62,52 +84,209 @@ class ObjectStorageReader(Reader):
         self._platform = platform
 
         self._format = file_format
-        self._reader = find_reader(self._format, kwargs)
+        self._file_reader = find_reader(self._format, kwargs)
+        self._reader = self._file_reader.get_csv_reader()
         self._dest_key_split = dest_key_split
+        self._prefetch_objects = prefetch_objects
+        self._download_slices = download_slices
+        self._slice_size = slice_size_mb * 1024 * 1024
+        self._time_ordered_keys = time_ordered_keys
+        self._listing_index = ListingIndex(listing_index) if listing_index else None
+        self._coalesce_max_bytes = coalesce_max_bytes
+        self._coalesce_max_files = coalesce_max_files
 
         self.MAX_TIMESTAMP_STATE_KEY = f"{self._platform}_max_timestamp".lower()
         self.MAX_FILES_STATE_KEY = f"{self._platform}_max_files".lower()
+        self.MAX_FILES_SET_STATE_KEY = f"{self._platform}_max_files_set".lower()
+        self.LAST_KEYS_STATE_KEY = f"{self._platform}_last_keys".lower()
+
+        # Checkpoint state, loaded once per run, then kept in sync with the state service
+        self._max_timestamp = None
+        self._max_files = set()
+        self._last_keys = {}
+
+    def load_checkpoint(self):
+        self._max_timestamp = self.state.get(self.MAX_TIMESTAMP_STATE_KEY)
+        self._max_files = self.state.get_set(self.MAX_FILES_SET_STATE_KEY)
+        legacy_max_files = self.state.get(self.MAX_FILES_STATE_KEY)
+        if not self._max_files and legacy_max_files:
+            # Checkpoints written as a list of keys are migrated to a set
+            self._max_files = set(legacy_max_files)
+            self.state.set_many({}, replaced_sets={self.MAX_FILES_SET_STATE_KEY: self._max_files})
+        self._last_keys = self.state.get(self.LAST_KEYS_STATE_KEY, {})
 
     def read(self):
 
-        for prefix in self._prefix_list:
+        self.load_checkpoint()
 
-            objects_sorted_by_time = sorted(
-                self.list_objects(bucket=self._bucket, prefix=prefix),
-                key=lambda o: self.get_timestamp(o),
-            )
+        # Prefixes are listed concurrently, while the objects of the first ones are read
+        executor = ThreadPoolExecutor(max_workers=min(len(self._prefix_list), MAX_LISTING_WORKERS) or 1)
+        listings = [executor.submit(self.list_objects_sorted_by_time, prefix) for prefix in self._prefix_list]
+        executor.shutdown(wait=False)
 
-            for _object in objects_sorted_by_time:
+        for prefix, listing in zip(self._prefix_list, listings):
 
-                _object = self.to_object(_object)
+            # Groups are made from the listed sizes: objects are only downloaded as their stream is read,
+            # so that prefetching stays at most prefetch_objects ahead, whatever the size of the groups
+            objects, objects_to_download = tee(self.list_objects_to_read(listing.result()))
 
-                logging.info(f"Found {self._platform} file {self.get_key(_object)}")
+            if self._prefetch_objects > 0:
+                downloads = self.prefetch_objects(objects_to_download)
+            else:
+                downloads = (
+                    (_object, lambda _object=_object: self.read_object(_object)) for _object in objects_to_download
+                )
 
-                if not self.is_compatible_object(_object):
-                    logging.info(
-                        f"Wrong extension: Skipping file {self.get_key(_object)}"
-                    )
-                    continue
+            for group in self.coalesce(objects):
 
-                if self.has_already_processed_object(_object):
-                    logging.info(
-                        f"Skipping already processed file {self.get_key(_object)}"
-                    )
-                    continue
+                def result_generator(group=group, prefix=prefix, downloads=downloads):
+                    for _object in group:
+                        # Streams are read in order, and so are the downloads of their objects
+                        _, get_file = next(downloads)
+                        temp = get_file()
 
-                def result_generator():
-                    temp = tempfile.TemporaryFile()
-                    self.download_object_to_file(_object, temp)
+                        for record in self._reader(temp):
+                            yield record
 
-                    for record in self._reader(temp):
-                        yield record
+                        temp.close()
 
-                    self.checkpoint_object(_object)
+                    for _object in group:
+                        self.checkpoint_object(_object)
+                    if self._time_ordered_keys:
+                        self.update_last_key(prefix, self.get_key(group[-1]))
 
-                name = self.get_key(_object).split("/", self._dest_key_split)[-1]
+                name = self.get_key(group[0]).split("/", self._dest_key_split)[-1]
 
                 yield NormalizedJSONStream(name, result_generator())
 
+    def coalesce(self, objects):
+        """
+            Groups consecutive objects read as a single stream, named after the first one, of at most
+            coalesce_max_files objects and coalesce_max_bytes bytes (limits set to 0 are ignored).
+            Objects larger than coalesce_max_bytes are read on their own.
+        """
+        if not self._coalesce_max_bytes and not self._coalesce_max_files:
+            yield from ([_object] for _object in objects)
+            return
+
+        group, group_size = [], 0
+        for _object in objects:
+            size = self.get_size(_object) if self._coalesce_max_bytes else 0
+            if group and (
+                (self._coalesce_max_files and len(group) >= self._coalesce_max_files)
+                or (self._coalesce_max_bytes and group_size + size > self._coalesce_max_bytes)
+            ):
+                yield group
+                group, group_size = [], 0
+            group.append(_object)
+            group_size += size
+        if group:
+            yield group
+
+    def list_objects_sorted_by_time(self, prefix):
+        """
+            Lists the objects of the prefix, from the oldest to the most recent one. When keys are
+            ordered by time, the listing starts after the last key processed by the previous runs.
+        """
+        start_after = self.get_last_key(prefix) if self._time_ordered_keys else None
+        if start_after:
+            logging.info(f"Listing {self._platform} prefix {prefix} from key {start_after}")
+        return sorted(
+            self.list_objects(bucket=self._bucket, prefix=prefix, start_after=start_after),
+            key=lambda o: self.get_timestamp(o),
+        )
+
+    def list_objects_to_read(self, objects_sorted_by_time):
+        """
+            Yields the compatible objects that have not been processed yet.
+        """
+        for _object in objects_sorted_by_time:
+
+            _object = self.to_object(_object)
+
+            logging.info(f"Found {self._platform} file {self.get_key(_object)}")
+
+            if not self.is_compatible_object(_object):
+                logging.info(
+                    f"Wrong extension: Skipping file {self.get_key(_object)}"
+                )
+                continue
+
+            if self.has_already_processed_object(_object):
+                logging.info(
+                    f"Skipping already processed file {self.get_key(_object)}"
+                )
+                continue
+
+            yield _object
+
+    def prefetch_objects(self, objects):
+        """
+            Downloads the next objects in a thread pool while the current one is read,
+            at most prefetch_objects objects ahead. Objects are yielded in their original order,
+            along with a function waiting for their download to complete.
+        """
+        with ThreadPoolExecutor(max_workers=self._prefetch_objects) as executor:
+            pending = deque()
+            for _object in objects:
+                pending.append((_object, executor.submit(self.download_object, _object)))
+                if len(pending) > self._prefetch_objects:
+                    _object, future = pending.popleft()
+                    yield _object, future.result
+            while pending:
+                _object, future = pending.popleft()
+                yield _object, future.result
+
+    def read_object(self, _object):
+        """
+            Returns a file object to read the object from: records are parsed as the object is downloaded,
+            unless the file format needs seeking, or the object is large enough to be downloaded in slices.
+        """
+        if self._file_reader.seekable_file_required or self.is_sliced(_object):
+            return self.download_object(_object)
+        return self.open_object(_object)
+
+    def download_object(self, _object):
+        temp = tempfile.TemporaryFile()
+        if self.is_sliced(_object):
+            self.download_object_in_slices(_object, temp)
+        else:
+            self.download_object_to_file(_object, temp)
+        return temp
+
+    def is_sliced(self, _object):
+        return self._download_slices > 1 and self.get_size(_object) > self._slice_size
+
+    def download_object_in_slices(self, _object, temp):
+        """
+            Downloads consecutive byte ranges of the object concurrently, each one being
+            retried on its own, and writes them at their offset of the pre-allocated file.
+        """
+        size = self.get_size(_object)
+        temp.truncate(size)
+        fd = temp.fileno()
+
+        @retry
+        def download_slice(start):
+            end = min(start + self._slice_size, size)
+            data = self.download_range(_object, start, end)
+            if len(data) != end - start:
+                raise IOError(f"Incomplete range {start}-{end} of {self.get_key(_object)}: got {len(data)} bytes")
+            os.pwrite(fd, data, start)
+
+        slice_starts = range(0, size, self._slice_size)
+        logging.info(f"Downloading {self.get_key(_object)} in {len(slice_starts)} slices")
+        with ThreadPoolExecutor(max_workers=self._download_slices) as executor:
+            for future in [executor.submit(download_slice, start) for start in slice_starts]:
+                future.result()
+
+    def open_object(self, _object):
+        """
+            Returns a file object reading the object content as it is downloaded.
+            Platforms that can't stream objects download them to a temporary file instead.
+        """
+        return self.download_object(_object)
+
     def is_compatible_object(self, _object):
         return self.get_key(_object).endswith("." + self._format)
 
@@ -115,7 +294,7 @@ class ObjectStorageReader(Reader):
 
         assert self.get_timestamp(_object) is not None, "Object has no timestamp!"
 
-        max_timestamp = self.state.get(self.MAX_TIMESTAMP_STATE_KEY)
+        max_timestamp = self._max_timestamp
 
         if no_files_seen_before(max_timestamp):
             return False
@@ -135,14 +314,13 @@ class ObjectStorageReader(Reader):
         if _object_as_old_as_most_recently_ingested_file(
             max_timestamp, _object_timestamp
         ):
-            max_files = self.state.get(self.MAX_FILES_STATE_KEY)
-            return self.get_key(_object) in max_files
+            return self.get_key(_object) in self._max_files
 
     def checkpoint_object(self, _object):
 
         assert self.get_timestamp(_object) is not None, "Object has no timestamp!"
 
-        max_timestamp = self.state.get(self.MAX_TIMESTAMP_STATE_KEY)
+        max_timestamp = self._max_timestamp
         _object_timestamp = self.get_timestamp(_object)
 
         if max_timestamp and _object_older_than_most_recently_ingested_file(
@@ -162,13 +340,27 @@ class ObjectStorageReader(Reader):
             self.update_max_files(_object)
 
     def update_max_timestamp(self, _object_timestamp, _object):
-        self.state.set(self.MAX_TIMESTAMP_STATE_KEY, _object_timestamp)
-        self.state.set(self.MAX_FILES_STATE_KEY, [self.get_key(_object)])
+        self._max_timestamp = _object_timestamp
+        self._max_files = {self.get_key(_object)}
+        self.state.set_many(
+            {self.MAX_TIMESTAMP_STATE_KEY: _object_timestamp},
+            replaced_sets={self.MAX_FILES_SET_STATE_KEY: self._max_files},
+        )
 
     def update_max_files(self, _object):
-        max_files = self.state.get(self.MAX_FILES_STATE_KEY)
-        max_files.append(self.get_key(_object))
-        self.state.set(self.MAX_FILES_STATE_KEY, max_files)
+        self._max_files.add(self.get_key(_object))
+        self.state.add_to_set(self.MAX_FILES_SET_STATE_KEY, self.get_key(_object))
+
+    def get_last_key(self, prefix):
+        if self._listing_index:
+            return self._listing_index.get(prefix)
+        return self._last_keys.get(prefix)
+
+    def update_last_key(self, prefix, key):
+        self._last_keys[prefix] = key
+        if self._listing_index:
+            self._listing_index.set(prefix, key)
+        self.state.set(self.LAST_KEYS_STATE_KEY, self._last_keys)
 
     def create_client(self, config):
         raise NotImplementedError
@@ -176,7 +368,7 @@ class ObjectStorageReader(Reader):
     def create_bucket(self, client, bucket):
         raise NotImplementedError
 
-    def list_objects(self, bucket, prefix):
+    def list_objects(self, bucket, prefix, start_after=None):
         raise NotImplementedError
 
     @staticmethod
@@ -194,3 +386,11 @@ class ObjectStorageReader(Reader):
     @staticmethod
     def download_object_to_file(_object, temp):
         raise NotImplementedError
+
+    @staticmethod
+    def get_size(_object):
+        raise NotImplementedError
+
+    @staticmethod
+    def download_range(_object, start, end):
+        raise NotImplementedError
@@ -15,21 +15,75 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import io
+
 import click
 
 import boto3
 from nck.commands.command import processor
 from nck.readers.objectstorage_reader import ObjectStorageReader
 from nck.utils.args import extract_args
+from nck.utils.file_reader import FileEnum
+from nck.utils.buffers import ReadableStream
 
 
 @click.command(name="read_s3")
 @click.option("--s3-bucket", required=True)
 @click.option("--s3-prefix", required=True, multiple=True)
-@click.option("--s3-format", required=True, type=click.Choice(["csv", "gz"]))
+@click.option(
+    "--s3-format", required=True, type=click.Choice([_format.lower() for _format in FileEnum.__members__])
+)
 @click.option("--s3-dest-key-split", default=-1, type=int)
 @click.option("--s3-csv-delimiter", default=",")
 @click.option("--s3-csv-fieldnames", default=None)
+@click.option(
+    "--s3-prefetch-objects",
+    default=0,
+    type=int,
+    help="Number of objects downloaded in advance, concurrently, while the current one is read",
+)
+@click.option(
+    "--s3-download-slices",
+    default=1,
+    type=int,
+    help="Number of byte ranges of large objects downloaded concurrently",
+)
+@click.option(
+    "--s3-slice-size-mb",
+    default=64,
+    type=int,
+    help="Size of the byte ranges of sliced downloads, in MB: only objects larger than it are sliced",
+)
+@click.option(
+    "--s3-parse-workers",
+    default=1,
+    type=int,
+    help="Number of processes parsing CSV and NJSON objects in parallel, by blocks of lines",
+)
+@click.option(
+    "--s3-time-ordered-keys",
+    is_flag=True,
+    default=False,
+    help="Keys sort in the same order as object timestamps (e.g. date-based paths): "
+    "only list keys after the last processed one",
+)
+@click.option(
+    "--s3-listing-index",
+    help="Local file in which the last processed key of each prefix is kept, "
+    "to list keys after it without a state service",
+)
+@click.option(
+    "--s3-coalesce-max-bytes",
+    default=0,
+    type=int,
+    help="Maximum size of consecutive objects merged into a single stream, in bytes (0: no limit)",
+)
+@click.option(
+    "--s3-coalesce-max-files",
+    default=0,
+    type=int,
+    help="Maximum number of consecutive objects merged into a single stream (0: no limit)",
+)
 @processor()
 def s3(**kwargs):
     return S3Reader(**extract_args("s3_", kwargs))
@@ -52,7 +106,9 @@ class S3Reader(ObjectStorageReader):
     def create_bucket(self, client, bucket):
         return client.Bucket(bucket)
 
-    def list_objects(self, bucket, prefix):
+    def list_objects(self, bucket, prefix, start_after=None):
+        if start_after:
+            return bucket.objects.filter(Prefix=prefix, StartAfter=start_after)
         return bucket.objects.filter(Prefix=prefix)
 
     @staticmethod
@@ -70,3 +126,17 @@ class S3Reader(ObjectStorageReader):
     @staticmethod
     def download_object_to_file(_object, temp):
         _object.download_fileobj(temp)
+
+    @staticmethod
+    def get_size(_object):
+        return _object.content_length
+
+    @staticmethod
+    def download_range(_object, start, end):
+        # Fails with a precondition error if the object is overwritten in the meantime,
+        # instead of mixing the content of both versions
+        return _object.get(Range=f"bytes={start}-{end - 1}", IfMatch=_object.e_tag)["Body"].read()
+
+    @staticmethod
+    def open_object(_object):
+        return io.BufferedReader(ReadableStream(_object.get()["Body"]))
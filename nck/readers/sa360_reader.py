@@ -23,7 +23,7 @@ from nck.streams.normalized_json_stream import NormalizedJSONStream
 from nck.clients.sa360_client import SA360Client
 from nck.helpers.sa360_helper import REPORT_TYPES
 from nck.utils.args import extract_args
-from nck.utils.text import get_report_generator_from_flat_file
+from nck.utils.text import get_record_batches_from_flat_file
 
 DATEFORMAT = "%Y-%m-%d"
 ENCODING = "utf-8"
@@ -112,7 +112,7 @@ class SA360Reader(Reader):
             for line_iterator in self.sa360_client.download_report_files(
                 report_data, report_id
             ):
-                yield from get_report_generator_from_flat_file(line_iterator)
+                yield from get_record_batches_from_flat_file(line_iterator)
 
     def read(self):
         if not self.advertiser_ids:
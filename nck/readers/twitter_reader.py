@@ -21,6 +21,7 @@ from nck.utils.args import extract_args
 from nck.commands.command import processor
 from nck.readers.reader import Reader
 from nck.streams.json_stream import JSONStream
+from nck.streams.record_batch import RecordBatch
 from nck.helpers.twitter_helper import (
     REPORT_TYPES,
     ENTITY_OBJECTS,
@@ -395,38 +396,38 @@ class TwitterReader(Reader):
 
     def parse(self, raw_analytics_response):
         """
-        Parse a single raw response into a generator of JSON-like records.
+        Parse a single raw response into a generator of record batches,
+        one per entity and segment, sharing the same keys.
         """
 
+        time_series_length = raw_analytics_response["time_series_length"]
         for entity_resp in raw_analytics_response["data"]:
             for entity_data in entity_resp["id_data"]:
-                entity_records = [
-                    {
-                        "id": entity_resp["id"],
-                        **{
-                            mt: 0
-                            if entity_data["metrics"][mt] is None
-                            else entity_data["metrics"][mt][i]
-                            for mt in entity_data["metrics"]
-                        },
-                    }
-                    for i in range(raw_analytics_response["time_series_length"])
+                metrics = entity_data["metrics"]
+                headers = ["id", *metrics]
+                columns = [[entity_resp["id"]] * time_series_length] + [
+                    [0] * time_series_length if metrics[mt] is None else metrics[mt]
+                    for mt in metrics
                 ]
+                entity_records = RecordBatch(headers, list(zip(*columns)))
                 entity_records = self.add_daily_timestamps(entity_records)
                 entity_records = self.add_segment(entity_records, entity_data)
-                yield from entity_records
+                yield entity_records
 
     def add_daily_timestamps(self, entity_records):
         """
-        Add daily timestamps to a list of records, if granularity is 'DAY'.
+        Add daily timestamps to a record batch, if granularity is 'DAY'.
         """
 
         if self.granularity == "DAY":
             period_items = self.get_daily_period_items()
-            return [
-                {**entity_records[i], "date": period_items[i].strftime(REP_DATEFORMAT)}
-                for i in range(len(entity_records))
-            ]
+            return RecordBatch(
+                [*entity_records.headers, "date"],
+                [
+                    (*row, period_items[i].strftime(REP_DATEFORMAT))
+                    for i, row in enumerate(entity_records.rows)
+                ],
+            )
         return entity_records
 
     def get_daily_period_items(self):
@@ -440,15 +441,15 @@ class TwitterReader(Reader):
 
     def add_segment(self, entity_records, entity_data):
         """
-        Add segment to a list of records, if a segmentation_type is requested.
+        Add segment to a record batch, if a segmentation_type is requested.
         """
 
         if self.segmentation_type:
             entity_segment = entity_data["segment"]["segment_name"]
-            return [
-                {**rec, self.segmentation_type.lower(): entity_segment}
-                for rec in entity_records
-            ]
+            return RecordBatch(
+                [*entity_records.headers, self.segmentation_type.lower()],
+                [(*row, entity_segment) for row in entity_records.rows],
+            )
         return entity_records
 
     def get_campaign_management_report(self):
@@ -535,7 +536,8 @@ class TwitterReader(Reader):
 
     def add_request_or_period_dates(self, record):
         """
-        Add request_date, period_start_date and/or period_end_date to a JSON-like record.
+        Add request_date, period_start_date and/or period_end_date to a JSON-like record,
+        or to each record of a record batch.
         """
 
         def check_add_period_date_to_report():
@@ -543,15 +545,25 @@ class TwitterReader(Reader):
                 self.report_type == "ANALYTICS" and self.granularity == "TOTAL"
             ) or self.report_type == "REACH"
 
+        dates = {}
         if self.add_request_date_to_report:
-            record["request_date"] = datetime.today().strftime(REP_DATEFORMAT)
+            dates["request_date"] = datetime.today().strftime(REP_DATEFORMAT)
 
         if check_add_period_date_to_report():
-            record["period_start_date"] = self.start_date.strftime(REP_DATEFORMAT)
-            record["period_end_date"] = (self.end_date - timedelta(days=1)).strftime(
+            dates["period_start_date"] = self.start_date.strftime(REP_DATEFORMAT)
+            dates["period_end_date"] = (self.end_date - timedelta(days=1)).strftime(
                 REP_DATEFORMAT
             )
 
+        if isinstance(record, RecordBatch):
+            if not dates:
+                return record
+            values = tuple(dates.values())
+            return RecordBatch(
+                [*record.headers, *dates], [(*row, *values) for row in record.rows]
+            )
+
+        record.update(dates)
         return record
 
     def read(self):
@@ -37,7 +37,7 @@ from nck.helpers.yandex_helper import (
 from nck.readers.reader import Reader
 from nck.streams.json_stream import JSONStream
 from nck.utils.args import extract_args
-from nck.utils.text import get_report_generator_from_flat_file
+from nck.utils.text import get_record_batches_from_flat_file
 
 
 class StrList(click.ParamType):
@@ -133,7 +133,7 @@ class YandexStatisticsReader(Reader):
                 logger.info("Report in queue.")
             elif response.status_code == HTTPStatus.OK:
                 logger.info("Report successfully retrieved.")
-                return get_report_generator_from_flat_file(
+                return get_record_batches_from_flat_file(
                     response.iter_lines(), delimiter="\t", skip_n_first=1,
                 )
             elif response.status_code == HTTPStatus.BAD_REQUEST:
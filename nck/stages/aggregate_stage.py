@@ -0,0 +1,129 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import logging
+
+import click
+
+from nck.commands.command import processor
+from nck.stages.stage import Stage
+from nck.utils.args import extract_args
+from nck.utils.spill import SpillFile, estimate_record_size
+
+SPILL_PARTITIONS = 16
+
+
+@click.command(name="aggregate")
+@click.option("--aggregate-group-by", required=True, multiple=True, help="Field to group records by. Can be repeated.")
+@click.option(
+    "--aggregate-sum", "aggregate_sum_fields", required=True, multiple=True, help="Numeric field to sum. Can be repeated."
+)
+@click.option(
+    "--aggregate-memory-mb",
+    default=256,
+    type=int,
+    help="Memory budget (in MB) of the aggregation table, before it is spilled to disk.",
+)
+@processor()
+def aggregate(**kwargs):
+    return AggregateStage(**extract_args("aggregate_", kwargs))
+
+
+def to_number(value, field=None):
+    if value is None or value == "":
+        return 0
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        pass
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        raise ValueError(f"Field {field}: {value!r} is not a number, and cannot be summed") from None
+
+
+class AggregateStage(Stage):
+    def __init__(self, group_by, sum_fields, memory_mb=256):
+        self._group_by = list(group_by)
+        self._sum = list(sum_fields)
+        self._memory_bytes = memory_mb * 1024 * 1024
+
+    def process(self, stream):
+        return self.rebuild_stream(stream, self.aggregate_records(stream))
+
+    def aggregate_records(self, records):
+        """
+            Hash aggregation: partial aggregates are spilled to disk, split into partitions
+            by group key, whenever the aggregation table exceeds the memory budget.
+            Each partition is then aggregated back on its own.
+        """
+        table = {}
+        table_size = 0
+        partitions = None
+
+        try:
+            for record in records:
+                key = tuple(record.get(field) for field in self._group_by)
+                values = [to_number(record.get(field), field) for field in self._sum]
+                table_size += self._merge(table, key, values)
+                if table_size >= self._memory_bytes:
+                    partitions = self._spill(table, partitions)
+                    table = {}
+                    table_size = 0
+
+            if partitions is None:
+                yield from self._to_records(table)
+                return
+
+            partitions = self._spill(table, partitions)
+            logging.info("Merging %d aggregation partitions spilled to disk", len(partitions))
+            for partition in partitions:
+                partition_table = {}
+                for key, values in partition:
+                    self._merge(partition_table, key, values)
+                yield from self._to_records(partition_table)
+        finally:
+            # Spill files are removed even if the aggregation fails (e.g. on a value that is not a number)
+            for partition in partitions or []:
+                partition.close()
+
+    @staticmethod
+    def _merge(table, key, values):
+        """Adds values to the aggregation table, and returns the memory used by a new group."""
+        aggregates = table.get(key)
+        if aggregates is None:
+            table[key] = values
+            return estimate_record_size(key) + estimate_record_size(values)
+        for i, value in enumerate(values):
+            aggregates[i] += value
+        return 0
+
+    @staticmethod
+    def _spill(table, partitions):
+        if partitions is None:
+            partitions = [SpillFile() for _ in range(SPILL_PARTITIONS)]
+        for key, values in table.items():
+            partitions[hash(key) % SPILL_PARTITIONS].write((key, values))
+        return partitions
+
+    def _to_records(self, table):
+        for key, values in table.items():
+            record = dict(zip(self._group_by, key))
+            record.update(zip(self._sum, values))
+            yield record
@@ -0,0 +1,183 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import logging
+import re
+from datetime import datetime
+from itertools import islice
+
+import click
+
+from nck.commands.command import processor
+from nck.stages.stage import Stage
+from nck.utils.args import extract_args
+
+BOOLEANS = {"true": True, "false": False}
+
+# Leading zeros are rejected, so that identifiers such as zip codes remain strings
+INT_PATTERN = re.compile(r"-?(0|[1-9][0-9]*)")
+FLOAT_PATTERN = re.compile(r"-?(0|[1-9][0-9]*|(0|[1-9][0-9]*)?\.[0-9]+)([eE][-+]?[0-9]+)?")
+
+
+def to_int(value):
+    if not INT_PATTERN.fullmatch(value):
+        raise ValueError(f"Invalid integer: {value}")
+    return int(value)
+
+
+def to_float(value):
+    if not FLOAT_PATTERN.fullmatch(value):
+        raise ValueError(f"Invalid float: {value}")
+    return float(value)
+
+
+def to_bool(value):
+    return BOOLEANS[value.lower()]
+
+
+def to_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+# Candidate types, from the most to the least specific
+CONVERTERS = {"int": to_int, "float": to_float, "bool": to_bool, "date": to_date}
+# Type a column is widened to when one of its values does not fit its inferred type
+WIDER_TYPES = {"int": "float"}
+
+
+@click.command(name="coerce")
+@click.option(
+    "--coerce-sample-size",
+    default=1000,
+    type=int,
+    help="Number of records sampled to infer column types. Records are then converted by batches of that size.",
+)
+@click.option(
+    "--coerce-null-invalid",
+    is_flag=True,
+    default=False,
+    help="Set values that cannot be converted to the type of their column to null, instead of failing",
+)
+@processor()
+def coerce(**kwargs):
+    return CoerceStage(**extract_args("coerce_", kwargs))
+
+
+def infer_type(values):
+    """Returns the most specific type all non-empty string values can be converted to, or None."""
+    values = [value for value in values if value != "" and value is not None]
+    if not values or not all(isinstance(value, str) for value in values):
+        return None
+    for type_name, converter in CONVERTERS.items():
+        try:
+            for value in values:
+                converter(value)
+            return type_name
+        except (ValueError, KeyError):
+            continue
+    return None
+
+
+class ColumnConverter(object):
+    """
+        Converts the values of a column to its inferred type. A value that does not fit the type widens it
+        when possible (e.g. a float in an integer column). Other values raise a ValueError, or are set to None
+        and counted if null_invalid is set.
+    """
+
+    def __init__(self, column, type_name, null_invalid=False):
+        self.column = column
+        self.type_name = type_name
+        self.invalid_count = 0
+        self._null_invalid = null_invalid
+
+    def __call__(self, value):
+        if value == "" or value is None:
+            return None
+        type_name = self.type_name
+        while type_name is not None:
+            try:
+                converted = CONVERTERS[type_name](value)
+            except (ValueError, KeyError, TypeError, AttributeError):
+                type_name = WIDER_TYPES.get(type_name)
+                continue
+            if type_name != self.type_name:
+                logging.info("Column %s: widening type %s to %s for %r", self.column, self.type_name, type_name, value)
+                self.type_name = type_name
+            return converted
+
+        if not self._null_invalid:
+            raise ValueError(
+                f"Column {self.column}: {value!r} cannot be converted to {self.type_name} "
+                "(use --coerce-null-invalid to set such values to null)"
+            )
+        self.invalid_count += 1
+        return None
+
+
+class CoerceStage(Stage):
+    def __init__(self, sample_size=1000, null_invalid=False):
+        self._sample_size = sample_size
+        self._null_invalid = null_invalid
+
+    def process(self, stream):
+        return self.rebuild_stream(stream, self.coerce_records(stream))
+
+    def coerce_records(self, records):
+        """
+            Infers column types on the first batch of records, then converts every batch
+            column by column, with converters built once per column.
+        """
+        records = iter(records)
+        batch = list(islice(records, self._sample_size))
+        converters = self.infer_converters(batch)
+        if not converters:
+            yield from batch
+            yield from records
+            return
+
+        while batch:
+            yield from self.convert_batch(batch, converters)
+            batch = list(islice(records, self._sample_size))
+
+        for converter in converters.values():
+            if converter.invalid_count:
+                logging.warning(
+                    "Column %s: %d values could not be converted to %s, and were set to null",
+                    converter.column,
+                    converter.invalid_count,
+                    converter.type_name,
+                )
+
+    def infer_converters(self, batch):
+        columns = {}
+        for record in batch:
+            for key, value in record.items():
+                columns.setdefault(key, []).append(value)
+
+        types = {column: infer_type(values) for column, values in columns.items()}
+        types = {column: type_name for column, type_name in types.items() if type_name}
+        logging.info("Coercing columns to the following types: %s", types)
+        return {column: ColumnConverter(column, type_name, self._null_invalid) for column, type_name in types.items()}
+
+    @staticmethod
+    def convert_batch(batch, converters):
+        for column, convert in converters.items():
+            for record in batch:
+                if column in record:
+                    record[column] = convert(record[column])
+        return batch
@@ -0,0 +1,84 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import heapq
+import logging
+
+import click
+
+from nck.commands.command import processor
+from nck.stages.stage import Stage
+from nck.utils.args import extract_args
+from nck.utils.spill import SpillFile, estimate_record_size
+
+
+@click.command(name="sort")
+@click.option("--sort-by", required=True, multiple=True, help="Field to sort records by. Can be repeated.")
+@click.option("--sort-descending", is_flag=True, default=False)
+@click.option(
+    "--sort-memory-mb",
+    default=256,
+    type=int,
+    help="Memory budget (in MB) of the in-memory runs, before being spilled to disk.",
+)
+@processor()
+def sort(**kwargs):
+    return SortStage(**extract_args("sort_", kwargs))
+
+
+class SortStage(Stage):
+    def __init__(self, by, descending=False, memory_mb=256):
+        self._by = list(by)
+        self._descending = descending
+        self._memory_bytes = memory_mb * 1024 * 1024
+
+    def process(self, stream):
+        return self.rebuild_stream(stream, self.sort_records(stream))
+
+    def sort_key(self, record):
+        # Missing values are grouped together, and never compared to actual values
+        return tuple((record.get(field) is None, record.get(field)) for field in self._by)
+
+    def sort_records(self, records):
+        """
+            External merge sort: sorted runs are spilled to disk once they exceed
+            the memory budget, then lazily merged back together.
+        """
+        runs = []
+        buffer = []
+        buffer_size = 0
+
+        for record in records:
+            buffer.append(record)
+            buffer_size += estimate_record_size(record)
+            if buffer_size >= self._memory_bytes:
+                runs.append(self._spill_run(buffer))
+                buffer = []
+                buffer_size = 0
+
+        buffer.sort(key=self.sort_key, reverse=self._descending)
+
+        if not runs:
+            yield from buffer
+            return
+
+        logging.info("Merging %d sorted runs spilled to disk", len(runs) + 1)
+        yield from heapq.merge(*runs, buffer, key=self.sort_key, reverse=self._descending)
+
+    def _spill_run(self, buffer):
+        buffer.sort(key=self.sort_key, reverse=self._descending)
+        return SpillFile().write_all(buffer)
@@ -0,0 +1,37 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import copy
+
+
+class Stage(object):
+    def process(self, stream):
+        """
+            The process method takes a stream object, and should return a stream object
+            of the same class, yielding the transformed records.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def rebuild_stream(stream, source_generator):
+        """
+            Returns a copy of the stream (same class and name), reading from a new generator.
+        """
+        new_stream = copy.copy(stream)
+        new_stream._source_generator = source_generator
+        new_stream._iterator = iter(source_generator)
+        return new_stream
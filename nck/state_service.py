@@ -68,6 +68,41 @@ class StateService(object):
 
         self._client.hset(self._name, key, pickle.dumps(value))
 
+    def get_set(self, key):
+        if not self.enabled:
+            return set()
+
+        return {pickle.loads(member) for member in self._client.smembers(self._set_name(key))}
+
+    def add_to_set(self, key, *members):
+        """
+            Adds members to a set, without reading or rewriting its other members.
+        """
+        if not self.enabled or not members:
+            return
+
+        self._client.sadd(self._set_name(key), *[pickle.dumps(member) for member in members])
+
+    def set_many(self, values, replaced_sets=None):
+        """
+            Sets several values, and replaces the members of several sets, in a single round trip.
+        """
+        if not self.enabled:
+            return
+
+        pipeline = self._client.pipeline()
+        for key, value in values.items():
+            pipeline.hset(self._name, key, pickle.dumps(value))
+        for key, members in (replaced_sets or {}).items():
+            pipeline.delete(self._set_name(key))
+            if members:
+                pipeline.sadd(self._set_name(key), *[pickle.dumps(member) for member in members])
+        pipeline.execute()
+
+    def _set_name(self, key):
+        # Sets are stored as their own Redis keys, next to the hash of values
+        return "{}:{}".format(self._name, key)
+
     @property
     def enabled(self):
         return self._enabled
@@ -16,9 +16,19 @@
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 import json
+from json.encoder import encode_basestring_ascii
 
 from nck.streams.stream import Stream
 
+_encode_value = json.JSONEncoder(default=str).encode
+
+
+def _encode_key(key):
+    """Encodes a key the same way as json.dumps, which converts None, bool, int and float keys to strings."""
+    if key.__class__ is str:
+        return encode_basestring_ascii(key)
+    return json.dumps({key: None})[1:-len(": null}")]
+
 
 class JSONStream(Stream):
     extension = "njson"
@@ -31,3 +41,24 @@ class JSONStream(Stream):
     @classmethod
     def encode_record(cls, record) -> str:
         return json.dumps(record, default=str)
+
+    @classmethod
+    def encode_batch_as_bytes(cls, batch) -> bytes:
+        # Subclasses transforming records when encoding them go through encode_record,
+        # as well as batches with duplicate keys
+        overrides_encode_record = cls.encode_record.__func__ is not JSONStream.encode_record.__func__
+        if overrides_encode_record or len(set(batch.headers)) < len(batch.headers):
+            return super().encode_batch_as_bytes(batch)
+
+        # Same output as json.dumps(record, default=str), with keys encoded once per batch
+        keys = [_encode_key(header) + ": " for header in batch.headers]
+        lines = []
+        for row in batch.rows:
+            fields = ", ".join(
+                [
+                    key + (encode_basestring_ascii(value) if value.__class__ is str else _encode_value(value))
+                    for key, value in zip(keys, row)
+                ]
+            )
+            lines.append("{" + fields + "}\n")
+        return "".join(lines).encode("utf-8")
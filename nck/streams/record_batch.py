@@ -0,0 +1,65 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+class RecordBatch(object):
+    """
+        Compact representation of consecutive records sharing the same keys:
+        the keys are stored once, and each record as a tuple of values.
+
+        Streams encode record batches natively. Iterating over a batch yields
+        one dict per record, for code expecting dicts.
+    """
+
+    __slots__ = ("headers", "rows")
+
+    def __init__(self, headers, rows):
+        self.headers = tuple(headers)
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        headers = self.headers
+        for row in self.rows:
+            yield dict(zip(headers, row))
+
+
+class ValueInterner(object):
+    """
+        Shares a single instance of repeated values (e.g. dimension values), so that
+        rows referencing the same value do not each hold their own copy.
+        The cache is reset once it exceeds max_size distinct values, to keep memory bounded.
+    """
+
+    def __init__(self, max_size=100000):
+        self._max_size = max_size
+        self._cache = {}
+
+    def __call__(self, value):
+        cached = self._cache.get(value)
+        if cached is not None:
+            return cached
+        if len(self._cache) >= self._max_size:
+            self._cache = {}
+        self._cache[value] = value
+        return value
+
+    def intern_row(self, row):
+        return tuple(map(self, row))
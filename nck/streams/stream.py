@@ -15,10 +15,18 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import time
 import io
 
+from nck.streams.record_batch import RecordBatch
+
+
+def _encode_chunk(stream_class, items):
+    return b"".join(map(stream_class.encode_as_bytes, items))
+
 
 class Stream(object):
     _name = None
@@ -27,9 +35,14 @@ class Stream(object):
     extension = None
     mime_type = "application/octet-stream"
 
+    # When greater than 1, records are encoded by chunks of encoding_chunk_size records
+    # (batches being counted by their records) in a pool of worker processes
+    encoding_workers = 1
+    encoding_chunk_size = 10000
+
     def __init__(self, name, source_generator):
         """
-            _source_generator is a generator yielding dicts
+            _source_generator is a generator yielding dicts, or RecordBatch objects
         """
         self._name = self.create_stream_name(name)
         self._source_generator = source_generator
@@ -41,12 +54,27 @@ class Stream(object):
     def __iter__(self):
         """
             The raw stream object can also be iterated.
-            You'll get the raw elements yielded by the generator.
+            You'll get the raw elements yielded by the generator
+            (record batches being converted to one dict per record).
         """
-        return self._iterator
+        return self._flatten(self._iterator)
 
-    def as_file(self) -> io.BufferedReader:
-        return self._iterable_to_stream(self._iterator, self.encode_record_as_bytes)
+    def as_file(self, on_record=None, on_bytes=None) -> io.BufferedReader:
+        """
+            on_record and on_bytes are optional callbacks, called with each record as it is encoded,
+            and with the resulting bytes (e.g. to compute statistics or checksums without reading
+            the stream twice).
+        """
+        iterator = self._iterator
+        if on_record is not None:
+            iterator = self._observe(iterator, on_record)
+        encode = self.encode_as_bytes
+        if self.encoding_workers > 1:
+            iterator = self._encode_in_parallel(iterator)
+            encode = bytes
+        if on_bytes is not None:
+            encode = self._observe_bytes(encode, on_bytes)
+        return self._iterable_to_stream(iterator, encode)
 
     def readlines(self):
         """
@@ -63,10 +91,20 @@ class Stream(object):
 
         return cls(source_stream.name, source_stream.readlines())
 
+    @classmethod
+    def encode_as_bytes(cls, item) -> bytes:
+        if isinstance(item, RecordBatch):
+            return cls.encode_batch_as_bytes(item)
+        return cls.encode_record_as_bytes(item)
+
     @classmethod
     def encode_record_as_bytes(cls, record) -> bytes:
         return (cls.encode_record(record) + "\n").encode("utf-8")
 
+    @classmethod
+    def encode_batch_as_bytes(cls, batch) -> bytes:
+        return b"".join(map(cls.encode_record_as_bytes, batch))
+
     @classmethod
     def encode_record(cls, record) -> str:
         raise NotImplementedError
@@ -75,6 +113,70 @@ class Stream(object):
     def decode_record(cls, record):
         raise NotImplementedError
 
+    @classmethod
+    def _encode_in_parallel(cls, iterator):
+        """
+            Yields the encoded bytes of consecutive chunks of records, in order.
+            At most 2 chunks per worker are pending at once, to keep memory bounded.
+        """
+        with ProcessPoolExecutor(max_workers=cls.encoding_workers) as executor:
+            pending = deque()
+            for chunk in cls._iter_chunks(iterator, cls.encoding_chunk_size):
+                pending.append(executor.submit(_encode_chunk, cls, chunk))
+                if len(pending) >= 2 * cls.encoding_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    @staticmethod
+    def _iter_chunks(iterator, chunk_size):
+        """
+            Groups items into chunks of at most chunk_size records, counting each record of a batch,
+            and splitting the batches larger than a chunk.
+        """
+        chunk, chunk_records = [], 0
+        for item in iterator:
+            if isinstance(item, RecordBatch):
+                parts = [RecordBatch(item.headers, item.rows[i : i + chunk_size]) for i in range(0, len(item), chunk_size)]
+            else:
+                parts = [item]
+            for part in parts:
+                records = len(part) if isinstance(part, RecordBatch) else 1
+                if chunk and chunk_records + records > chunk_size:
+                    yield chunk
+                    chunk, chunk_records = [], 0
+                chunk.append(part)
+                chunk_records += records
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def _flatten(iterator):
+        for item in iterator:
+            if isinstance(item, RecordBatch):
+                yield from item
+            else:
+                yield item
+
+    @staticmethod
+    def _observe(iterator, on_record):
+        for item in iterator:
+            if isinstance(item, RecordBatch):
+                for record in item:
+                    on_record(record)
+            else:
+                on_record(item)
+            yield item
+
+    @staticmethod
+    def _observe_bytes(encode, on_bytes):
+        def observed_encode(record):
+            chunk = encode(record)
+            on_bytes(chunk)
+            return chunk
+
+        return observed_encode
+
     @staticmethod
     def create_stream_name(name):
         ts = time.time()
@@ -111,7 +213,11 @@ class Stream(object):
             def readinto(self, b):
                 try:
                     chunck_length = len(b)  # We're supposed to return at most this much
-                    chunk = self.leftover or encode(next(iterable))
+                    # memoryview slices avoid copying the rest of large chunks on each read
+                    chunk = self.leftover
+                    # Empty chunks (e.g. empty record batches) must be skipped, as returning 0 means EOF
+                    while not chunk:
+                        chunk = memoryview(encode(next(iterable)))
                     output, self.leftover = chunk[:chunck_length], chunk[chunck_length:]
                     b[: len(output)] = output
                     self.count += len(output)
@@ -0,0 +1,150 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import io
+import shutil
+import tempfile
+
+SPOOL_BUFFER_SIZE = 1024 * 1024
+
+
+class RewindableStream(io.RawIOBase):
+    """
+        Wraps a forward-only file object, keeping its last window_size bytes in memory,
+        so that it can be rewound (e.g. to resend the chunks an upload failed to commit).
+    """
+
+    def __init__(self, file, window_size):
+        self._file = file
+        self._window_size = window_size
+        self._buffer = bytearray()
+        self._buffer_start = 0
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("Only absolute positions are supported")
+        buffer_end = self._buffer_start + len(self._buffer)
+        if not self._buffer_start <= offset <= buffer_end:
+            raise ValueError(f"Cannot seek to {offset}: only bytes {self._buffer_start}-{buffer_end} are buffered")
+        self._position = offset
+        return offset
+
+    def readinto(self, b):
+        buffer_end = self._buffer_start + len(self._buffer)
+        if self._position == buffer_end:
+            data = self._file.read(len(b))
+            if not data:
+                return 0
+            self._buffer += data
+            buffer_end += len(data)
+            # Bytes that have not been read yet are never dropped
+            overflow = min(len(self._buffer) - self._window_size, self._position - self._buffer_start)
+            if overflow > 0:
+                del self._buffer[:overflow]
+                self._buffer_start += overflow
+
+        start = self._position - self._buffer_start
+        data = self._buffer[start : start + len(b)]
+        b[: len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self.readall()
+        chunks = []
+        while size > 0:
+            chunk = bytearray(size)
+            n = self.readinto(chunk)
+            if not n:
+                break
+            chunks.append(bytes(chunk[:n]))
+            size -= n
+        return b"".join(chunks)
+
+
+class ReadableStream(io.RawIOBase):
+    """
+        Wraps an object only exposing read(size), such as an HTTP response body,
+        into a raw file object, so that it can be buffered and iterated line by line.
+    """
+
+    def __init__(self, source):
+        self._source = source
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self._source.read(len(b))
+        b[: len(data)] = data
+        return len(data)
+
+    def close(self):
+        if hasattr(self._source, "close"):
+            self._source.close()
+        super().close()
+
+
+class RangeReader(io.RawIOBase):
+    """
+        Reads a remote object of known size sequentially, as consecutive byte ranges
+        of chunk_size bytes, fetched with fetch_range(start, end) (end excluded).
+    """
+
+    def __init__(self, fetch_range, size, chunk_size):
+        self._fetch_range = fetch_range
+        self._size = size
+        self._chunk_size = chunk_size
+        self._chunk = memoryview(b"")
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if not self._chunk:
+            if self._position >= self._size:
+                return 0
+            end = min(self._position + self._chunk_size, self._size)
+            self._chunk = memoryview(self._fetch_range(self._position, end))
+            self._position = end
+        n = min(len(b), len(self._chunk))
+        b[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+
+def spool(file):
+    """
+        Copies a forward-only file object into a temporary file, rewound to its start,
+        e.g. to know the checksums of a stream before deciding to upload it.
+    """
+    spooled_file = tempfile.TemporaryFile()
+    shutil.copyfileobj(file, spooled_file, SPOOL_BUFFER_SIZE)
+    spooled_file.seek(0)
+    return spooled_file
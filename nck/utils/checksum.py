@@ -0,0 +1,102 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import base64
+import hashlib
+import json
+
+try:
+    import google_crc32c
+except ImportError:  # CRC32C checksums are only computed if google-crc32c is installed
+    google_crc32c = None
+
+# boto3 TransferConfig defaults, used to compute the ETag of multipart S3 uploads
+S3_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+S3_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+
+
+class StreamChecksums(object):
+    """
+        Checksums of the bytes of a stream, updated incrementally as they are read,
+        so that uploads can be validated without downloading them back.
+    """
+
+    def __init__(self, part_size=S3_MULTIPART_CHUNKSIZE):
+        self.size = 0
+        self._md5 = hashlib.md5()
+        self._crc32c = google_crc32c.Checksum() if google_crc32c else None
+        self._part_size = part_size
+        self._part_md5 = hashlib.md5()
+        self._part_length = 0
+        self._part_digests = []
+
+    def update(self, chunk):
+        self.size += len(chunk)
+        self._md5.update(chunk)
+        if self._crc32c:
+            self._crc32c.update(chunk)
+        self._update_parts(chunk)
+
+    def _update_parts(self, chunk):
+        while chunk:
+            part_chunk = chunk[: self._part_size - self._part_length]
+            self._part_md5.update(part_chunk)
+            self._part_length += len(part_chunk)
+            chunk = chunk[len(part_chunk):]
+            if self._part_length == self._part_size:
+                self._part_digests.append(self._part_md5.digest())
+                self._part_md5 = hashlib.md5()
+                self._part_length = 0
+
+    @property
+    def md5_hex(self):
+        return self._md5.hexdigest()
+
+    @property
+    def md5_base64(self):
+        return base64.b64encode(self._md5.digest()).decode("utf-8")
+
+    @property
+    def crc32c_base64(self):
+        if not self._crc32c:
+            return None
+        return base64.b64encode(self._crc32c.digest()).decode("utf-8")
+
+    def s3_etag(self, multipart_threshold=S3_MULTIPART_THRESHOLD):
+        """ETag S3 computes for an upload of these bytes: the MD5 of part MD5s for multipart uploads."""
+        if self.size < multipart_threshold:
+            return self.md5_hex
+        digests = list(self._part_digests)
+        if self._part_length:
+            digests.append(self._part_md5.digest())
+        return "{}-{}".format(hashlib.md5(b"".join(digests)).hexdigest(), len(digests))
+
+    def to_dict(self):
+        return {"size": self.size, "md5": self.md5_base64, "crc32c": self.crc32c_base64}
+
+
+class UploadManifest(object):
+    """List of the objects uploaded during a run, with their sizes and checksums."""
+
+    def __init__(self):
+        self.objects = []
+
+    def add(self, uri, checksums):
+        self.objects.append({"uri": uri, **checksums.to_dict()})
+
+    def to_json(self):
+        return json.dumps({"objects": self.objects}, indent=2)
@@ -0,0 +1,123 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import json
+import math
+
+STATS_EXTENSION = ".stats.json"
+
+_MASK_64 = (1 << 64) - 1
+
+
+def _mix_64(x):
+    """splitmix64 finalizer, spreading Python hashes (e.g. of small integers) over 64 bits."""
+    x &= _MASK_64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK_64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK_64
+    return x ^ (x >> 31)
+
+
+class HyperLogLog(object):
+    """Approximate distinct count, with a ~1.6% standard error for the default precision."""
+
+    def __init__(self, precision=12):
+        self._precision = precision
+        self._registers = bytearray(1 << precision)
+
+    def add(self, value):
+        x = _mix_64(hash(value))
+        index = x >> (64 - self._precision)
+        remaining_bits = x & ((1 << (64 - self._precision)) - 1)
+        rank = 64 - self._precision - remaining_bits.bit_length() + 1
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def count(self):
+        m = len(self._registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self._registers)
+        zeros = self._registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class _ColumnStatistics(object):
+    def __init__(self):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self._comparable_type = None
+        self._distinct = HyperLogLog()
+
+    def add(self, value):
+        self.count += 1
+        if isinstance(value, (dict, list)):
+            self._distinct.add(json.dumps(value, sort_keys=True, default=str))
+            return
+
+        self._distinct.add(value)
+        # min and max are only tracked for the type of the first value seen in the column
+        if self._comparable_type is None:
+            self._comparable_type = type(value)
+            self.min = self.max = value
+        elif type(value) is self._comparable_type:
+            if value < self.min:
+                self.min = value
+            elif value > self.max:
+                self.max = value
+
+    def to_dict(self, row_count):
+        return {
+            "count": self.count,
+            "null_count": row_count - self.count,
+            "min": self.min,
+            "max": self.max,
+            "approx_distinct_count": self._distinct.count(),
+        }
+
+
+class StreamStatistics(object):
+    """
+        Single-pass per-column statistics of the records of a stream,
+        to be updated with each record as it is encoded.
+    """
+
+    def __init__(self):
+        self.row_count = 0
+        self._columns = {}
+
+    def update(self, record):
+        self.row_count += 1
+        if not isinstance(record, dict):
+            return
+        for key, value in record.items():
+            if value is None:
+                continue
+            column = self._columns.get(key)
+            if column is None:
+                column = self._columns[key] = _ColumnStatistics()
+            column.add(value)
+
+    def to_dict(self):
+        return {
+            "row_count": self.row_count,
+            "columns": {key: column.to_dict(self.row_count) for key, column in self._columns.items()},
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), default=str)
@@ -27,3 +27,9 @@ class SdfOperationError(Exception):
     """Raised when a sdf operation has failed."""
 
     pass
+
+
+class ChecksumMismatchError(Exception):
+    """Raised when the checksum of an uploaded object doesn't match the one of the uploaded bytes."""
+
+    pass
@@ -16,14 +16,46 @@
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 from enum import Enum
+import bz2
 import csv
 import codecs
 import gzip
+import io
+import logging
+import lzma
+import posixpath
 import zipfile
 import json
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from nck.streams.record_batch import RecordBatch
+from nck.utils.buffers import ReadableStream
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet files can only be read if pyarrow is installed
+    pq = None
+
+try:
+    import zstandard
+except ImportError:  # Zstandard files can only be read if zstandard is installed
+    zstandard = None
 
 csv.field_size_limit(1000000)
 
+# Extensions of the ZIP members that are read, other members being skipped
+ZIP_DATA_EXTENSIONS = (".csv", ".tsv", ".txt")
+# Number of CSV rows per record batch
+CSV_BATCH_SIZE = 10000
+# Number of bytes read and decoded at once by the fast CSV path
+TEXT_CHUNK_SIZE = 1024 * 1024
+# Quote character of CSV values, as expected by csv.reader by default
+CSV_QUOTECHAR = b'"'
+# Number of bytes parsed at once by each worker process, when parsing in parallel
+PARSE_BLOCK_SIZE = 8 * 1024 * 1024
+
 
 def unzip(input_file, output_path):
     with zipfile.ZipFile(input_file, 'r') as zip_ref:
@@ -33,9 +65,124 @@ def unzip(input_file, output_path):
 def sdf_to_njson_generator(path_to_file):
     csv_reader = CSVReader(csv_delimiter=",", csv_fieldnames=None)
     with open(path_to_file, "rb") as fd:
-        dict_reader = csv_reader.read_csv(fd)
-        for line in dict_reader:
-            yield line
+        for item in csv_reader.read_csv(fd):
+            if isinstance(item, RecordBatch):
+                yield from item
+            else:
+                yield item
+
+
+def batch_rows(rows, headers):
+    """
+        Yields CSV rows as record batches. Rows are completed or skipped the same way as by csv.DictReader.
+    """
+    width = len(headers)
+    batch = []
+    for row in rows:
+        if len(row) == width:
+            batch.append(row)
+        elif not row:
+            continue
+        elif len(row) < width:
+            batch.append(row + [None] * (width - len(row)))
+        else:
+            # Extra values are kept under the None key, as csv.DictReader does
+            if batch:
+                yield RecordBatch(headers, batch)
+                batch = []
+            record = dict(zip(headers, row))
+            record[None] = row[width:]
+            yield record
+        if len(batch) >= CSV_BATCH_SIZE:
+            yield RecordBatch(headers, batch)
+            batch = []
+    if batch:
+        yield RecordBatch(headers, batch)
+
+
+def parse_csv_block(block, delimiter, headers):
+    rows = csv.reader(io.StringIO(block.decode("utf-8"), newline=""), delimiter=delimiter)
+    return list(batch_rows(rows, headers))
+
+
+def parse_njson_block(block):
+    return [json.loads(line) for line in block.splitlines() if line.strip()]
+
+
+def read_record(fd, quotechar=None, line=b""):
+    """
+        Completes the line into a full record: with a quotechar, lines are appended until quotes are balanced,
+        as a line break within a quoted value leaves an odd number of quotes (escaped quotes being doubled).
+    """
+    if not line.endswith(b"\n"):
+        line += fd.readline()
+    if quotechar is not None:
+        quotes = line.count(quotechar)
+        while quotes % 2:
+            next_line = fd.readline()
+            if not next_line:
+                break
+            line += next_line
+            quotes += next_line.count(quotechar)
+    return line
+
+
+def iter_line_blocks(fd, block_size, quotechar=None):
+    """
+        Yields consecutive blocks of about block_size bytes of the file, each one ending at a line boundary,
+        outside of quoted values if a quotechar is given.
+    """
+    while True:
+        block = fd.read(block_size)
+        if not block:
+            return
+        yield read_record(fd, quotechar, block)
+
+
+def _put_unless_stopped(pending, stopped, item):
+    while not stopped.is_set():
+        try:
+            pending.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def _submit_blocks(fd, executor, pending, stopped, parse_block, args, quotechar):
+    try:
+        for block in iter_line_blocks(fd, PARSE_BLOCK_SIZE, quotechar):
+            if stopped.is_set():
+                return
+            _put_unless_stopped(pending, stopped, executor.submit(parse_block, block, *args))
+        _put_unless_stopped(pending, stopped, None)
+    except Exception as e:
+        _put_unless_stopped(pending, stopped, e)
+
+
+def parse_blocks_in_parallel(fd, workers, parse_block, *args, quotechar=None):
+    """
+        Reads (and decompresses) the file by blocks of records in its own thread, parses the blocks
+        with parse_block in a pool of worker processes, and yields the parsed items in the file order.
+        At most 2 blocks per worker are pending at once, to keep memory bounded.
+    """
+    pending = queue.Queue(maxsize=2 * workers)
+    stopped = threading.Event()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        reader = threading.Thread(
+            target=_submit_blocks, args=(fd, executor, pending, stopped, parse_block, args, quotechar), daemon=True
+        )
+        reader.start()
+        try:
+            while True:
+                item = pending.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield from item.result()
+        finally:
+            stopped.set()
+            reader.join()
 
 
 def format_csv_delimiter(csv_delimiter):
@@ -61,14 +208,27 @@ def format_csv_fieldnames(csv_fieldnames):
 
 
 class CSVReader(object):
-    def __init__(self, csv_delimiter, csv_fieldnames, **kwargs):
+    # Whether files must be seekable to be read, instead of being read as they are downloaded
+    seekable_file_required = False
+
+    def __init__(self, csv_delimiter, csv_fieldnames, parse_workers=1, **kwargs):
         self.csv_delimiter = format_csv_delimiter(csv_delimiter)
         self.csv_fieldnames = format_csv_fieldnames(csv_fieldnames) if csv_fieldnames is not None else None
+        self.parse_workers = parse_workers
         self.csv_reader = lambda fd: self.read_csv(fd, **kwargs)
 
     def read_csv(self, fd, **kwargs):
-        fd.seek(0)
+        if fd.seekable():
+            fd.seek(0)
         fd = self.decompress(fd)
+        if self.parse_workers > 1 and not kwargs:
+            return self.parse_in_parallel(fd)
+        return self.parse(fd, **kwargs)
+
+    def parse(self, fd, **kwargs):
+        if not kwargs:
+            return self.parse_rows(fd)
+        # Options specific to csv.DictReader are only supported by the dict-based path
         return csv.DictReader(
             codecs.iterdecode(fd, encoding="utf-8"),
             delimiter=str(self.csv_delimiter),
@@ -76,6 +236,37 @@ class CSVReader(object):
             **kwargs,
         )
 
+    def parse_rows(self, fd):
+        """
+            Fast path: decodes the file in large chunks, and yields its rows as record batches,
+            sharing the header computed once, rather than as one dict per row.
+        """
+        text = io.TextIOWrapper(fd, encoding="utf-8", newline="")
+        text._CHUNK_SIZE = TEXT_CHUNK_SIZE
+        try:
+            rows = csv.reader(text, delimiter=str(self.csv_delimiter))
+            headers = self.csv_fieldnames if self.csv_fieldnames is not None else next(rows, None)
+            if headers is not None:
+                yield from batch_rows(rows, headers)
+        finally:
+            # The file is closed by its owner, not by the text wrapper
+            text.detach()
+
+    def parse_in_parallel(self, fd):
+        """
+            Parses blocks of rows in a process pool. Blocks are split at line breaks outside of quoted values,
+            assuming quotes only delimit values or are doubled within them, as csv.reader writes them.
+        """
+        headers = self.csv_fieldnames
+        if headers is None:
+            header = read_record(fd, CSV_QUOTECHAR).decode("utf-8")
+            headers = next(csv.reader(io.StringIO(header, newline=""), delimiter=str(self.csv_delimiter)), None)
+            if headers is None:
+                return
+        yield from parse_blocks_in_parallel(
+            fd, self.parse_workers, parse_csv_block, str(self.csv_delimiter), headers, quotechar=CSV_QUOTECHAR
+        )
+
     def decompress(self, fd):
         return fd
 
@@ -89,6 +280,94 @@ class GZReader(CSVReader):
         return gzf
 
 
+class BZ2Reader(CSVReader):
+    def decompress(self, fd):
+        return bz2.BZ2File(fd, mode="rb")
+
+
+class XZReader(CSVReader):
+    def decompress(self, fd):
+        return lzma.LZMAFile(fd, mode="rb")
+
+
+class ZSTReader(CSVReader):
+    def __init__(self, csv_delimiter, csv_fieldnames, **kwargs):
+        if zstandard is None:
+            raise ImportError("The zstandard package is required to read .zst files")
+        super().__init__(csv_delimiter, csv_fieldnames, **kwargs)
+
+    def decompress(self, fd):
+        # The decompression stream can't be iterated line by line unless it is buffered
+        return io.BufferedReader(ReadableStream(zstandard.ZstdDecompressor().stream_reader(fd)))
+
+
+class NJSONReader(CSVReader):
+    def parse(self, fd, **kwargs):
+        for line in fd:
+            if line.strip():
+                yield json.loads(line)
+
+    def parse_in_parallel(self, fd):
+        return parse_blocks_in_parallel(fd, self.parse_workers, parse_njson_block)
+
+
+class ZIPReader(CSVReader):
+    """
+        Reads the CSV files of a ZIP archive one after the other, decompressing
+        each one as it is read, rather than extracting the archive first.
+    """
+
+    seekable_file_required = True
+
+    def read_csv(self, fd, **kwargs):
+        fd.seek(0)
+        with zipfile.ZipFile(fd) as zip_file:
+            for member in zip_file.infolist():
+                if not self.is_data_member(member):
+                    if not member.is_dir():
+                        logging.info(f"Skipping ZIP member {member.filename}: not a data file")
+                    continue
+                with zip_file.open(member) as member_file:
+                    yield from self.parse(member_file, **kwargs)
+
+    @staticmethod
+    def is_data_member(member):
+        """
+            Whether the member is a data file, rather than a directory, hidden file (e.g. .DS_Store)
+            or resource fork added by macOS archivers under __MACOSX/.
+        """
+        if member.is_dir() or member.filename.startswith("__MACOSX/"):
+            return False
+        name = posixpath.basename(member.filename)
+        return not name.startswith(".") and posixpath.splitext(name)[1].lower() in ZIP_DATA_EXTENSIONS
+
+
+class ParquetReader(CSVReader):
+    """
+        Reads Parquet files one row group at a time, yielding each one as a record batch.
+    """
+
+    seekable_file_required = True
+
+    def __init__(self, csv_delimiter, csv_fieldnames, **kwargs):
+        if pq is None:
+            raise ImportError("The pyarrow package is required to read .parquet files")
+        super().__init__(csv_delimiter, csv_fieldnames, **kwargs)
+
+    def read_csv(self, fd, **kwargs):
+        fd.seek(0)
+        parquet_file = pq.ParquetFile(fd)
+        for i in range(parquet_file.num_row_groups):
+            columns = parquet_file.read_row_group(i).to_pydict()
+            yield RecordBatch(columns.keys(), list(zip(*columns.values())))
+
+
 class FileEnum(Enum):
     CSV = CSVReader
     GZ = GZReader
+    BZ2 = BZ2Reader
+    XZ = XZReader
+    ZST = ZSTReader
+    NJSON = NJSONReader
+    ZIP = ZIPReader
+    PARQUET = ParquetReader
@@ -0,0 +1,46 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import json
+import os
+import tempfile
+
+
+class ListingIndex(object):
+    """
+        Local JSON file keeping, for each listed prefix, the last key that has been processed,
+        so that the next listing can start after it, without a state service.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._last_keys = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self._last_keys = json.load(f)
+
+    def get(self, prefix):
+        return self._last_keys.get(prefix)
+
+    def set(self, prefix, key):
+        self._last_keys[prefix] = key
+        # The index is replaced atomically, so that an interrupted run never leaves it corrupted
+        directory = os.path.dirname(os.path.abspath(self._path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with open(fd, "w") as f:
+            json.dump(self._last_keys, f)
+        os.replace(tmp_path, self._path)
@@ -0,0 +1,66 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import pickle
+import sys
+import tempfile
+
+
+def estimate_record_size(record):
+    """Rough estimate of the memory footprint of a record, in bytes."""
+    size = sys.getsizeof(record)
+    if isinstance(record, dict):
+        for key, value in record.items():
+            size += sys.getsizeof(key) + sys.getsizeof(value)
+    elif isinstance(record, (list, tuple)):
+        for value in record:
+            size += sys.getsizeof(value)
+    return size
+
+
+class SpillFile(object):
+    """
+        Temporary file in which records are spilled, in a compact binary (pickle) format,
+        then read back lazily, in the same order.
+    """
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._pickler = pickle.Pickler(self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.count = 0
+
+    def write(self, record):
+        self._pickler.dump(record)
+        # Avoid keeping every spilled record alive in the pickler memo
+        self._pickler.clear_memo()
+        self.count += 1
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+        return self
+
+    def __iter__(self):
+        self._file.flush()
+        self._file.seek(0)
+        unpickler = pickle.Unpickler(self._file)
+        for _ in range(self.count):
+            yield unpickler.load()
+        self.close()
+
+    def close(self):
+        self._file.close()
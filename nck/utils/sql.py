@@ -64,3 +64,11 @@ def build_custom_query(engine, query, watermark_column, watermark_value):
         statement = statement.bindparams(**params)
 
     return statement
+
+
+def create_table(engine, schema, table, columns):
+    meta = get_meta(engine, schema)
+    table = sqlalchemy.Table(table, meta, *columns)
+    table.create(engine)
+
+    return table
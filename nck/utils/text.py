@@ -22,6 +22,8 @@ from io import StringIO
 from collections import deque
 from itertools import islice
 
+from nck.streams.record_batch import RecordBatch, ValueInterner
+
 
 def get_report_generator_from_flat_file(
     line_iterator,
@@ -53,12 +55,66 @@ def get_report_generator_from_flat_file(
         to add at the end of each record (can include multiple column_names)
     """
 
+    rows = get_rows_from_flat_file(line_iterator, delimiter, skip_n_first, skip_n_last)
+    headers = next(rows, None)
+    for parsed_line in rows:
+        record = dict(zip(headers, parsed_line))
+        if add_column:
+            yield {**record, **column_dict}
+        else:
+            yield record
+
+
+def get_record_batches_from_flat_file(
+    line_iterator,
+    delimiter=",",
+    skip_n_first=0,
+    skip_n_last=0,
+    add_column=False,
+    column_dict={},
+    batch_size=10000,
+):
+    """
+    Same as get_report_generator_from_flat_file, but returns a generator of
+    RecordBatch objects of at most batch_size records: headers are stored once
+    per batch, records as tuples, and repeated values are interned.
+    """
+    rows = get_rows_from_flat_file(line_iterator, delimiter, skip_n_first, skip_n_last)
+    headers = next(rows, None)
+    if headers is None:
+        return
+    column_dict = column_dict if add_column else {}
+    # Same keys order as {**record, **column_dict}
+    overridden_values = [(i, column_dict[header]) for i, header in enumerate(headers) if header in column_dict]
+    new_columns = [key for key in column_dict if key not in headers]
+    extra_values = tuple(column_dict[key] for key in new_columns)
+    headers = headers + new_columns
+
+    interner = ValueInterner()
+    batch = []
+    for parsed_line in rows:
+        for i, value in overridden_values:
+            parsed_line[i] = value
+        batch.append(interner.intern_row(parsed_line) + extra_values)
+        if len(batch) >= batch_size:
+            yield RecordBatch(headers, batch)
+            batch = []
+    if batch:
+        yield RecordBatch(headers, batch)
+
+
+def get_rows_from_flat_file(line_iterator, delimiter=",", skip_n_first=0, skip_n_last=0):
+    """
+    From the line iterator of a flat file, return a generator yielding the parsed
+    headers first, then each parsed line having as many values as headers.
+    """
     first_line = True
     for line in skip(line_iterator, skip_n_first, skip_n_last):
         line = decode_if_needed(line)
         if first_line:
             first_line = False
             headers = parse_decoded_line(line, delimiter)
+            yield headers
         else:
             parsed_line = parse_decoded_line(line, delimiter)
             if len(parsed_line) != len(headers):
@@ -66,11 +122,7 @@ def get_report_generator_from_flat_file(
                     f"Skipping line '{line}': length of parsed line doesn't match length of headers."
                 )
             else:
-                record = dict(zip(headers, parsed_line))
-                if add_column:
-                    yield {**record, **column_dict}
-                else:
-                    yield record
+                yield parsed_line
 
 
 def decode_if_needed(line):
@@ -22,6 +22,7 @@ from nck.writers.console_writer import console
 from nck.writers.local_writer import local
 from nck.writers.bigquery_writer import bq
 from nck.writers.s3_writer import s3
+from nck.writers.sql_writer import sql
 
 
 writers = [
@@ -29,7 +30,8 @@ writers = [
     console,
     local,
     bq,
-    s3
+    s3,
+    sql
     # "oracle": oracle,
     # "gsheets": gsheets,
     # "salesforce": salesforce
@@ -15,12 +15,18 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import datetime
+import itertools
+import uuid
+from collections import Counter, OrderedDict, deque
+
 import config
 
 import click
 
 from config import logging
 
+from google.api_core.exceptions import NotFound
 from google.cloud import bigquery
 from nck.streams.normalized_json_stream import NormalizedJSONStream
 from nck.writers.writer import Writer
@@ -28,13 +34,17 @@ from nck.writers.gcs_writer import GCSWriter
 from nck.commands.command import processor
 from nck.utils.args import extract_args
 from nck.utils.retry import retry
+from nck.stages.sort_stage import SortStage
 from nck.helpers.google_base import GoogleBaseClass
 
+# Metadata key of staged files kept with --bq-skip-unchanged, set to the table they have been loaded into
+LOADED_METADATA_KEY = "nck-loaded-into"
+
 
 @click.command(name="write_bq")
 @click.option("--bq-dataset", required=True)
 @click.option("--bq-table", required=True)
-@click.option("--bq-bucket", required=True)
+@click.option("--bq-bucket", help="Cloud Storage bucket in which the file is staged before being loaded")
 @click.option("--bq-partition-column")
 @click.option(
     "--bq-write-disposition",
@@ -43,6 +53,37 @@ from nck.helpers.google_base import GoogleBaseClass
 )
 @click.option("--bq-location", default="EU", type=click.Choice(["EU", "US"]))
 @click.option("--bq-keep-files", is_flag=True, default=False)
+@click.option(
+    "--bq-direct-load",
+    is_flag=True,
+    default=False,
+    help="Load the stream into BigQuery directly, without staging it in a Cloud Storage bucket",
+)
+@click.option(
+    "--bq-batch-loads",
+    is_flag=True,
+    default=False,
+    help="Stage every stream in Cloud Storage first, then load them all at once when the run ends",
+)
+@click.option(
+    "--bq-merge-key",
+    multiple=True,
+    help="Column identifying a row: records are loaded into a staging table, then merged (upserted) into the "
+    "destination table on this key",
+)
+@click.option(
+    "--bq-merge-order-by",
+    multiple=True,
+    help="Column ordering the rows of the stream sharing a merge key: the row with the greatest value is merged. "
+    "Without it, the merge fails if keys are duplicated",
+)
+@click.option(
+    "--bq-skip-unchanged",
+    is_flag=True,
+    default=False,
+    help="Keep staged files under stable names, and skip the load of files whose content is unchanged since the "
+    "previous run",
+)
 @processor()
 def bq(**kwargs):
     return BigQueryWriter(**extract_args("bq_", kwargs))
@@ -51,6 +92,18 @@ def bq(**kwargs):
 class BigQueryWriter(Writer, GoogleBaseClass):
     _client = None
 
+    # Maximum number of source URIs accepted by a single load job
+    MAX_SOURCE_URIS = 10000
+    # Maximum number of partitions of a stream loaded with one load job each: above it, partitions are
+    # replaced through a staging table and a single query, to spare the load job quota of the table
+    MAX_PARTITION_LOAD_JOBS = 100
+    # Maximum number of partition load jobs running at once
+    MAX_CONCURRENT_LOAD_JOBS = 10
+    # Memory budget of the sort grouping records by partition, before sorted runs are spilled to disk
+    PARTITION_SORT_MEMORY_MB = 256
+    # Field holding the partition of each record while records are sorted by partition
+    PARTITION_FIELD = "_nck_partition"
+
     def __init__(
         self,
         dataset,
@@ -60,7 +113,20 @@ class BigQueryWriter(Writer, GoogleBaseClass):
         write_disposition,
         location,
         keep_files,
+        direct_load=False,
+        batch_loads=False,
+        merge_key=(),
+        skip_unchanged=False,
+        merge_order_by=(),
     ):
+        if not bucket and not direct_load:
+            raise click.BadParameter("You must specify a bucket to stage files, unless loading them directly")
+        if direct_load and batch_loads:
+            raise click.BadParameter("Batched loads require files to be staged, they cannot be combined with direct load")
+        if merge_order_by and not merge_key:
+            raise click.BadParameter("Rows can only be ordered to be merged if a merge key is set")
+        if direct_load and skip_unchanged:
+            raise click.BadParameter("Unchanged files are detected once staged, this cannot be combined with direct load")
 
         self._project_id = config.PROJECT_ID
         self._client = bigquery.Client(
@@ -73,47 +139,354 @@ class BigQueryWriter(Writer, GoogleBaseClass):
         self._write_disposition = write_disposition
         self._location = location
         self._keep_files = keep_files
+        self._direct_load = direct_load
+        self._batch_loads = batch_loads
+        self._staged_blobs = []
+        self._skip_unchanged = skip_unchanged and write_disposition == "append" and not merge_key
+        if skip_unchanged and not self._skip_unchanged:
+            # A skipped stream must not be removed by the truncation of the table (or of the merge staging table)
+            logging.warning("Unchanged files can only be skipped with the append write disposition, without merge keys")
+        self._staged_file_counts = Counter()
+        self._merge_key = list(merge_key)
+        self._merge_order_by = list(merge_order_by)
+        if self._merge_key:
+            # Streams are loaded into a staging table, which is reloaded for every merge
+            self._write_disposition = "truncate"
+            self._staging_table = "{}_staging_{}".format(table, uuid.uuid4().hex[:8])
 
     @retry
     def write(self, stream):
 
         normalized_stream = NormalizedJSONStream.create_from_stream(stream)
 
-        gcs_writer = GCSWriter(self._bucket, self._project_id)
-        gcs_uri, blob = gcs_writer.write(normalized_stream)
+        if self._merge_key:
+            if self._load(normalized_stream, self._staging_table, staged_file_name=self._table):
+                self._merge()
+        elif self._partition_column and self._write_disposition == "truncate":
+            # Only rewrite the partitions present in the stream, instead of the whole table
+            self._load_partitions(normalized_stream)
+        else:
+            self._load(normalized_stream, self._table)
 
-        table_ref = self._get_table_ref()
+    def _load(self, normalized_stream, table, staged_file_name=None, pending_loads=None):
+        """
+            Loads the stream into the table, unless its load is deferred (batched loads)
+            or skipped (unchanged content). Returns whether it has been loaded.
+            If a pending_loads list is given, the load job is added to it instead of being waited for.
+        """
+        table_ref = self._get_table_ref(table)
 
-        load_job = self._client.load_table_from_uri(
-            gcs_uri, table_ref, job_config=self.job_config()
-        )
+        if self._direct_load:
+            blob = None
+            load_job = self._client.load_table_from_file(
+                normalized_stream.as_file(), table_ref, job_config=self.job_config()
+            )
+        else:
+            gcs_writer = self._get_gcs_writer(staged_file_name or table)
+            gcs_uri, blob = gcs_writer.write(normalized_stream)
+            unchanged = gcs_uri in gcs_writer.skipped_uris and self._is_loaded(blob, table)
 
-        logging.info("Loading data into BigQuery %s:%s", self._dataset, self._table)
-        result = load_job.result()
+            if self._batch_loads:
+                logging.info("Staged %s, it will be loaded when all streams are written", gcs_uri)
+                self._staged_blobs.append((table, gcs_uri, blob, unchanged))
+                return False
+            if unchanged:
+                logging.info("Skipping load of %s into BigQuery %s:%s: content unchanged", gcs_uri, self._dataset, table)
+                return False
 
-        assert result.state == "DONE"
+            load_job = self._client.load_table_from_uri(
+                gcs_uri, table_ref, job_config=self.job_config()
+            )
+
+        logging.info("Loading data into BigQuery %s:%s", self._dataset, table)
+        if pending_loads is not None:
+            pending_loads.append((load_job, blob, table))
+        else:
+            self._finish_load(load_job, blob, table)
+        return True
+
+    def _finish_load(self, load_job, blob, table):
+        self._wait_for_load_job(load_job)
+        if blob is not None and self._skip_unchanged:
+            self._mark_loaded(blob, table)
 
-        if not self._keep_files:
-            logging.info("Deleting GCS file: %s", gcs_uri)
+        if blob is not None and not self._keep_files and not self._skip_unchanged:
+            logging.info("Deleting GCS file: gs://%s/%s", blob.bucket.name, blob.name)
             blob.delete()
 
+    def _loaded_table_id(self, table):
+        return "{}.{}.{}".format(self._project_id, self._dataset, table)
+
+    def _is_loaded(self, blob, table):
+        """
+            Whether the staged file has been loaded into the table: files are only marked as loaded once
+            their load job has succeeded, and uploading a file again removes its mark.
+        """
+        blob.reload()
+        return (blob.metadata or {}).get(LOADED_METADATA_KEY) == self._loaded_table_id(table)
+
+    def _mark_loaded(self, blob, table):
+        blob.metadata = {LOADED_METADATA_KEY: self._loaded_table_id(table)}
+        blob.patch()
+
+    def _get_gcs_writer(self, name):
+        if not self._skip_unchanged:
+            return GCSWriter(self._bucket, self._project_id)
+        # Staged files keep the same name from one run to the next, to be compared with the previous ones
+        name = name.replace("$", "_")
+        file_name = "{}_{}".format(name, self._staged_file_counts[name])
+        self._staged_file_counts[name] += 1
+        return GCSWriter(self._bucket, self._project_id, prefix=self._dataset, file_name=file_name, skip_unchanged=True)
+
+    def _load_partitions(self, normalized_stream):
+        """
+            Loads each partition of the stream into its own partition of the table, with load jobs running
+            concurrently. Streams spanning too many partitions are loaded into a staging table instead,
+            whose partitions then replace the ones of the table, with a single query.
+        """
+        partitions, partition_streams = self._group_by_partition(normalized_stream)
+        logging.info("Stream %s spans %d partition(s)", normalized_stream.name, len(partitions))
+
+        if len(partitions) > self.MAX_PARTITION_LOAD_JOBS and not self._batch_loads:
+            staging_table = "{}_staging_{}".format(self._table, uuid.uuid4().hex[:8])
+            records = (record for _, partition_stream in partition_streams for record in partition_stream)
+            stream = NormalizedJSONStream(normalized_stream.name, records)
+            if self._load(stream, staging_table, staged_file_name=self._table):
+                self._apply_staging_table(staging_table, self.replace_partitions_query)
+            return
+
+        pending_loads = deque()
+        for partition, partition_stream in partition_streams:
+            self._load(partition_stream, "{}${}".format(self._table, partition), pending_loads=pending_loads)
+            if len(pending_loads) >= self.MAX_CONCURRENT_LOAD_JOBS:
+                self._finish_load(*pending_loads.popleft())
+        while pending_loads:
+            self._finish_load(*pending_loads.popleft())
+
+    def _group_by_partition(self, normalized_stream):
+        """
+            Sorts the records of the stream by partition, with an external sort spilling sorted runs to disk,
+            so that the number of open files doesn't depend on the number of partitions.
+            Returns the set of partitions, and the stream of each partition, to be read one after the other.
+        """
+        partitions = set()
+
+        def records_with_partition():
+            partition_key = None
+            for record in normalized_stream:
+                if partition_key is None or partition_key not in record:
+                    partition_key = self._find_partition_key(record)
+                record[self.PARTITION_FIELD] = self._partition_id(record[partition_key])
+                partitions.add(record[self.PARTITION_FIELD])
+                yield record
+
+        sort_stage = SortStage(by=[self.PARTITION_FIELD], memory_mb=self.PARTITION_SORT_MEMORY_MB)
+        sorted_records = sort_stage.sort_records(records_with_partition())
+        # Every record has been read, and its partition collected, once the first sorted record is available
+        first_record = next(sorted_records, None)
+        if first_record is None:
+            return partitions, iter(())
+
+        def without_partition(records):
+            for record in records:
+                del record[self.PARTITION_FIELD]
+                yield record
+
+        groups = itertools.groupby(
+            itertools.chain([first_record], sorted_records), key=lambda record: record[self.PARTITION_FIELD]
+        )
+        partition_streams = (
+            (partition, NormalizedJSONStream("{}_{}".format(self._table, partition), without_partition(records)))
+            for partition, records in groups
+        )
+        return partitions, partition_streams
+
+    def _find_partition_key(self, record):
+        for key in record:
+            if key == self._partition_column or NormalizedJSONStream._normalize_key(key) == self._partition_column:
+                return key
+        raise ValueError("Partition column {} is missing from record {}".format(self._partition_column, record))
+
+    def _partition_id(self, value):
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            return value.strftime("%Y%m%d")
+        try:
+            return datetime.datetime.strptime(str(value)[:10], "%Y-%m-%d").strftime("%Y%m%d")
+        except ValueError:
+            raise ValueError("Partition column {} has a non-date value: {}".format(self._partition_column, value))
+
+    def close(self):
+        if not self._staged_blobs:
+            return
+
+        load_jobs = self._load_staged_blobs()
+        if self._merge_key and load_jobs:
+            self._merge()
+
+        if not self._keep_files and not self._skip_unchanged:
+            for _, gcs_uri, blob, _ in self._staged_blobs:
+                logging.info("Deleting GCS file: %s", gcs_uri)
+                blob.delete()
+        self._staged_blobs = []
+
+    def _load_staged_blobs(self):
+        """
+            Loads the staged files of each table, except unchanged ones, and returns the load jobs.
+        """
+        blobs_by_table = OrderedDict()
+        for table, gcs_uri, blob, unchanged in self._staged_blobs:
+            if unchanged:
+                logging.info("Skipping load of %s into BigQuery %s:%s: content unchanged", gcs_uri, self._dataset, table)
+                continue
+            blobs_by_table.setdefault(table, []).append((gcs_uri, blob))
+
+        load_jobs = []
+        for table, blobs in blobs_by_table.items():
+            load_jobs.extend(self._submit_batch_load(table, [gcs_uri for gcs_uri, _ in blobs]))
+        for load_job in load_jobs:
+            self._wait_for_load_job(load_job)
+
+        if self._skip_unchanged:
+            for table, blobs in blobs_by_table.items():
+                for _, blob in blobs:
+                    self._mark_loaded(blob, table)
+        return load_jobs
+
+    def _submit_batch_load(self, table, uris):
+        table_ref = self._get_table_ref(table)
+        uri_groups = [uris[i:i + self.MAX_SOURCE_URIS] for i in range(0, len(uris), self.MAX_SOURCE_URIS)]
+
+        logging.info(
+            "Loading %d staged files into BigQuery %s:%s with %d load job(s)",
+            len(uris), self._dataset, table, len(uri_groups)
+        )
+
+        load_jobs = [self._client.load_table_from_uri(uri_groups[0], table_ref, job_config=self.job_config())]
+        if len(uri_groups) > 1:
+            # Remaining groups are appended, so the first load must have truncated the table beforehand
+            if self._write_disposition == "truncate":
+                self._wait_for_load_job(load_jobs[0])
+            append_config = self.job_config(write_disposition="append")
+            load_jobs.extend(
+                self._client.load_table_from_uri(uri_group, table_ref, job_config=append_config)
+                for uri_group in uri_groups[1:]
+            )
+        return load_jobs
+
+    def _merge(self):
+        # A missing destination table is created empty, so that the stream is merged into it like into an existing one
+        self._apply_staging_table(self._staging_table, self.merge_query, copy_if_missing=False)
+
+    def _apply_staging_table(self, staging_table, build_query, copy_if_missing=True):
+        """
+            Applies the staging table to the destination table with the query returned by build_query
+            for its columns, then deletes it. If the destination table doesn't exist yet, the staging table
+            is copied, or the destination table is created with its schema, if copy_if_missing is False.
+        """
+        target_ref = self._get_table_ref()
+        staging_ref = self._get_table_ref(staging_table)
+        try:
+            staging = self._client.get_table(staging_ref)
+            staging_columns = [field.name for field in staging.schema]
+            try:
+                target_columns = [field.name for field in self._client.get_table(target_ref).schema]
+            except NotFound:
+                logging.info("Creating BigQuery %s:%s from staging table", self._dataset, self._table)
+                if copy_if_missing:
+                    self._client.copy_table(staging_ref, target_ref, location=self._location).result()
+                    return
+                target = bigquery.Table(target_ref, schema=staging.schema)
+                target.time_partitioning = staging.time_partitioning
+                self._client.create_table(target)
+                target_columns = staging_columns
+            logging.info("Applying staging table to BigQuery %s:%s", self._dataset, self._table)
+            columns = self._common_columns(target_columns, staging_columns)
+            self._client.query(build_query(columns, staging_table), location=self._location).result()
+        finally:
+            self._client.delete_table(staging_ref, not_found_ok=True)
+
+    def _common_columns(self, target_columns, staging_columns):
+        """
+            Columns of the destination table also present in the staging table, in the destination table order:
+            the staging schema, detected from the stream, may have drifted from the destination one.
+        """
+        new_columns = [column for column in staging_columns if column not in target_columns]
+        if new_columns:
+            logging.warning(
+                "Columns %s are missing from BigQuery %s:%s, they won't be written", new_columns, self._dataset, self._table
+            )
+        return [column for column in target_columns if column in staging_columns]
+
+    def _table_id(self, table):
+        return "`{}.{}.{}`".format(self._project_id, self._dataset, table)
+
+    def replace_partitions_query(self, columns, staging_table):
+        """
+            Replaces the partitions of the table present in the staging table, in a single transaction.
+        """
+        target, staging = self._table_id(self._table), self._table_id(staging_table)
+        column_list = ", ".join("`{}`".format(column) for column in columns)
+        return (
+            "BEGIN TRANSACTION; "
+            "DELETE FROM {target} WHERE DATE(`{column}`) IN (SELECT DISTINCT DATE(`{column}`) FROM {staging}); "
+            "INSERT INTO {target} ({columns}) SELECT {columns} FROM {staging}; "
+            "COMMIT TRANSACTION;"
+        ).format(target=target, staging=staging, column=self._partition_column, columns=column_list)
+
+    def merge_query(self, columns, staging_table=None):
+        table_id = self._table_id
+        staging_table = staging_table or self._staging_table
+
+        condition = " AND ".join("T.`{0}` = S.`{0}`".format(key) for key in self._merge_key)
+        updated_columns = [column for column in columns if column not in self._merge_key]
+        inserted_columns = ", ".join("`{}`".format(column) for column in columns)
+
+        # MERGE fails if several source rows match the same destination row: rows sharing a key are either
+        # ordered, to keep the greatest one, or rejected, as BigQuery would keep an arbitrary one of them
+        keys = ", ".join("`{}`".format(key) for key in self._merge_key)
+        if self._merge_order_by:
+            order_by = ", ".join("`{}` DESC".format(column) for column in self._merge_order_by)
+            source = "(SELECT * FROM {} WHERE TRUE QUALIFY ROW_NUMBER() OVER (PARTITION BY {} ORDER BY {}) = 1)".format(
+                table_id(staging_table), keys, order_by
+            )
+            query = ""
+        else:
+            source = table_id(staging_table)
+            query = (
+                "ASSERT NOT EXISTS (SELECT 1 FROM {} GROUP BY {} HAVING COUNT(*) > 1) "
+                "AS 'Rows of the stream share merge keys: set --bq-merge-order-by to merge the greatest one'; "
+            ).format(source, keys)
+        query += "MERGE {} T USING {} S ON {}".format(table_id(self._table), source, condition)
+        if updated_columns:
+            query += " WHEN MATCHED THEN UPDATE SET {}".format(
+                ", ".join("`{0}` = S.`{0}`".format(column) for column in updated_columns)
+            )
+        query += " WHEN NOT MATCHED THEN INSERT ({0}) VALUES ({0})".format(inserted_columns)
+        return query
+
+    @staticmethod
+    def _wait_for_load_job(load_job):
+        result = load_job.result()
+        assert result.state == "DONE"
+
     def _get_dataset(self):
         dataset_ref = self._client.dataset(self._dataset)
         return bigquery.Dataset(dataset_ref)
 
-    def _get_table_ref(self):
+    def _get_table_ref(self, table=None):
         dataset = self._get_dataset()
-        return dataset.table(self._table)
+        return dataset.table(table or self._table)
 
-    def job_config(self):
+    def job_config(self, write_disposition=None):
+        write_disposition = write_disposition or self._write_disposition
         job_config = bigquery.LoadJobConfig()
         job_config.create_disposition = bigquery.job.CreateDisposition.CREATE_IF_NEEDED
         job_config.source_format = bigquery.job.SourceFormat.NEWLINE_DELIMITED_JSON
         job_config.autodetect = True
 
-        if self._write_disposition == "truncate":
+        if write_disposition == "truncate":
             job_config.write_disposition = bigquery.job.WriteDisposition.WRITE_TRUNCATE
-        elif self._write_disposition == "append":
+        elif write_disposition == "append":
             job_config.write_disposition = bigquery.job.WriteDisposition.WRITE_APPEND
         else:
             raise Exception("Unknown BigQuery write disposition")
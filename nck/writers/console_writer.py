@@ -16,6 +16,7 @@
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 import click
+import shutil
 import sys
 
 from nck.writers.writer import Writer
@@ -39,7 +40,5 @@ class ConsoleWriter(Writer):
         """
         # this is how to read from a file as stream
         file = stream.as_file()
-        buffer = "buf"
-        while len(buffer) > 0:
-            buffer = file.read(1024)
-            sys.stdout.buffer.write(buffer)
+        shutil.copyfileobj(file, sys.stdout.buffer, 1024 * 1024)
+        sys.stdout.buffer.flush()
@@ -18,13 +18,28 @@
 import config
 import logging
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from nck.helpers.google_base import GoogleBaseClass
 import click
 
 from nck.writers.writer import Writer
 from nck.commands.command import processor
 from nck.utils.args import extract_args
+from nck.utils.column_stats import StreamStatistics, STATS_EXTENSION
+from nck.utils.checksum import StreamChecksums, UploadManifest
+from nck.utils.exceptions import ChecksumMismatchError
+from nck.utils.buffers import RewindableStream, spool
+from google.api_core.exceptions import NotFound
 from google.cloud import storage
+from google.resumable_media import InvalidResponse
+import requests
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+
+# Maximum number of source objects of a single GCS compose request
+MAX_COMPOSE_SOURCES = 32
+# Connect and read timeouts of the requests of resumable uploads, in seconds
+UPLOAD_REQUEST_TIMEOUT = (10, 120)
 
 
 @click.command(name="write_gcs")
@@ -35,6 +50,42 @@ from google.cloud import storage
     "--gcs-file-name",
     help="Override the default name of the file (don't add the extension)",
 )
+@click.option(
+    "--gcs-write-stats",
+    is_flag=True,
+    default=False,
+    help="Write per-column statistics of the file in a .stats.json blob next to it",
+)
+@click.option(
+    "--gcs-manifest-name",
+    help="Name of a manifest blob, written under the prefix at the end of the run, "
+    "listing the uploaded blobs with their sizes and checksums",
+)
+@click.option(
+    "--gcs-chunk-size-mb",
+    default=100,
+    type=int,
+    help="Size of the chunks of resumable uploads (and of the parts of parallel composite uploads), in MB",
+)
+@click.option(
+    "--gcs-upload-retries",
+    default=5,
+    type=int,
+    help="Number of times a failed chunk is resent, resuming the upload from the last committed offset",
+)
+@click.option(
+    "--gcs-parallel-uploads",
+    default=1,
+    type=int,
+    help="If greater than 1, the file is uploaded as parts uploaded concurrently, then composed into a single blob",
+)
+@click.option(
+    "--gcs-skip-unchanged",
+    is_flag=True,
+    default=False,
+    help="Spool the file on local disk to compute its checksums, and skip the upload if the destination blob "
+    "already has the same content",
+)
 @processor()
 def gcs(**kwargs):
     return GCSWriter(**extract_args("gcs_", kwargs))
@@ -43,7 +94,22 @@ def gcs(**kwargs):
 class GCSWriter(Writer, GoogleBaseClass):
     _client = None
 
-    def __init__(self, bucket, project_id, prefix=None, file_name=None):
+    def __init__(
+        self,
+        bucket,
+        project_id,
+        prefix=None,
+        file_name=None,
+        write_stats=False,
+        manifest_name=None,
+        chunk_size_mb=100,
+        upload_retries=5,
+        parallel_uploads=1,
+        skip_unchanged=False,
+    ):
+        if skip_unchanged and file_name is None:
+            # Stream names vary between runs (e.g. with dates), so blobs would never be compared
+            raise click.BadParameter("--gcs-skip-unchanged requires a stable --gcs-file-name")
         project_id = self.get_project_id(project_id)
         self._client = storage.Client(
             credentials=self._get_credentials(), project=project_id
@@ -51,6 +117,14 @@ class GCSWriter(Writer, GoogleBaseClass):
         self._bucket = self._client.bucket(bucket)
         self._prefix = prefix
         self._file_name = file_name
+        self._write_stats = write_stats
+        self._manifest_name = manifest_name
+        self._manifest = UploadManifest()
+        self._chunk_size = chunk_size_mb * 1024 * 1024
+        self._upload_retries = upload_retries
+        self._parallel_uploads = parallel_uploads
+        self._skip_unchanged = skip_unchanged
+        self.skipped_uris = []
 
     def write(self, stream):
         """
@@ -69,13 +143,185 @@ class GCSWriter(Writer, GoogleBaseClass):
             else stream.name
         )
         blob = self.create_blob(file_name)
-        blob.upload_from_file(stream.as_file(), content_type=stream.mime_type)
+        stats = StreamStatistics() if self._write_stats else None
+        checksums = StreamChecksums()
+        file = stream.as_file(on_record=stats.update if stats else None, on_bytes=checksums.update)
         uri = self.uri_for_name(file_name)
+        if self._skip_unchanged:
+            file = spool(file)
+            if self.is_unchanged(blob, checksums):
+                logging.info("Skipping upload to {}: its content is unchanged".format(uri))
+                file.close()
+                self.skipped_uris.append(uri)
+                self._manifest.add(uri, checksums)
+                return uri, blob
+
+        if self._parallel_uploads > 1:
+            self.upload_composite(blob, file, stream.mime_type)
+        else:
+            self.upload_resumable(blob, file, stream.mime_type)
+        file.close()
+        self.validate_checksums(blob, checksums)
+        self._manifest.add(uri, checksums)
 
         logging.info("Uploaded file to {}".format(uri))
 
+        if stats:
+            stats_blob = self.create_blob(file_name + STATS_EXTENSION)
+            stats_blob.upload_from_string(stats.to_json(), content_type="application/json")
+            logging.info("Uploaded file statistics to {}".format(self.uri_for_name(file_name + STATS_EXTENSION)))
+
         return uri, blob
 
+    def upload_resumable(self, blob, file, content_type):
+        """
+            Chunked resumable upload, through the GCS resumable upload protocol. When a chunk fails to be sent,
+            the upload is resumed from the last offset committed by GCS, rather than restarted from scratch:
+            the last chunk sent is kept in memory to be sent again. The upload session only lives as long as
+            this call, as streams generated by another run may have a different content.
+        """
+        rewindable_file = RewindableStream(file, window_size=self._chunk_size)
+        session_url = blob.create_resumable_upload_session(content_type=content_type, client=self._client)
+        logging.info("Started resumable upload session {}".format(session_url))
+
+        offset = 0
+        failures = 0
+        finished = False
+        while not finished:
+            chunk = rewindable_file.read(self._chunk_size)
+            try:
+                offset, finished = self.send_chunk(session_url, offset, chunk, last=len(chunk) < self._chunk_size)
+                failures = 0
+            except (InvalidResponse, RequestsConnectionError, Timeout) as e:
+                failures += 1
+                if failures > self._upload_retries:
+                    raise
+                logging.warning("Failed to send chunk ({}), resuming upload from last committed offset".format(e))
+                offset = self.get_committed_offset(session_url)
+            rewindable_file.seek(offset)
+
+        blob.reload(client=self._client)
+
+    @staticmethod
+    def send_chunk(session_url, offset, chunk, last):
+        """
+            Sends a chunk starting at offset, and returns the offset committed by GCS,
+            and whether the upload is complete.
+        """
+        end = offset + len(chunk)
+        if not last:
+            content_range = "bytes {}-{}/*".format(offset, end - 1)
+        elif chunk:
+            content_range = "bytes {}-{}/{}".format(offset, end - 1, end)
+        else:
+            content_range = "bytes */{}".format(end)
+        response = requests.put(
+            session_url, data=chunk, headers={"Content-Range": content_range}, timeout=UPLOAD_REQUEST_TIMEOUT
+        )
+        if response.status_code in (200, 201):
+            return end, True
+        return GCSWriter._committed_offset(response), False
+
+    @staticmethod
+    def get_committed_offset(session_url):
+        response = requests.put(session_url, headers={"Content-Range": "bytes */*"}, timeout=UPLOAD_REQUEST_TIMEOUT)
+        if response.status_code in (200, 201):
+            raise InvalidResponse(response, "Upload session {} is already complete".format(session_url))
+        return GCSWriter._committed_offset(response)
+
+    @staticmethod
+    def _committed_offset(response):
+        if response.status_code != 308:
+            if response.status_code < 500 and response.status_code not in (408, 429):
+                response.raise_for_status()
+            raise InvalidResponse(response, "Unexpected status code {}".format(response.status_code))
+        # The Range header (e.g. "bytes=0-1048575") is missing when no byte has been committed yet
+        committed_range = response.headers.get("Range")
+        return int(committed_range.split("-")[-1]) + 1 if committed_range else 0
+
+    def upload_composite(self, blob, file, content_type):
+        """
+            Parallel composite upload: consecutive parts of the file are uploaded concurrently
+            as temporary blobs, then composed into the destination blob. Temporary blobs are deleted
+            whether the upload succeeds or not.
+        """
+        temporary_blobs = []
+        try:
+            parts = self._upload_parts(blob, file, content_type, temporary_blobs)
+
+            logging.info("Composing {} parts into {}".format(len(parts), blob.name))
+            level = 0
+            while len(parts) > MAX_COMPOSE_SOURCES:
+                composed_parts = []
+                for i in range(0, len(parts), MAX_COMPOSE_SOURCES):
+                    composed_part = self._bucket.blob("{}.compose-{}-{:05d}".format(blob.name, level, i))
+                    temporary_blobs.append(composed_part)
+                    composed_part.content_type = content_type
+                    composed_part.compose(parts[i : i + MAX_COMPOSE_SOURCES])
+                    composed_parts.append(composed_part)
+                parts = composed_parts
+                level += 1
+
+            blob.content_type = content_type
+            blob.compose(parts)
+        finally:
+            for temporary_blob in temporary_blobs:
+                try:
+                    temporary_blob.delete()
+                except NotFound:
+                    # The upload of the part failed, or never started
+                    pass
+
+    def _upload_parts(self, blob, file, content_type, temporary_blobs):
+        parts = []
+        with ThreadPoolExecutor(max_workers=self._parallel_uploads) as executor:
+            pending = deque()
+            while True:
+                data = file.read(self._chunk_size)
+                if not data and parts:
+                    break
+                part = self._bucket.blob("{}.part-{:05d}".format(blob.name, len(parts)))
+                parts.append(part)
+                temporary_blobs.append(part)
+                pending.append(executor.submit(part.upload_from_string, data, content_type=content_type))
+                # Bounds the number of parts held in memory
+                if len(pending) >= self._parallel_uploads:
+                    pending.popleft().result()
+                if len(data) < self._chunk_size:
+                    break
+            for future in pending:
+                future.result()
+        return parts
+
+    def close(self):
+        if self._manifest_name and self._manifest.objects:
+            manifest_blob = self.create_blob(self._manifest_name)
+            manifest_blob.upload_from_string(self._manifest.to_json(), content_type="application/json")
+            logging.info("Uploaded manifest to {}".format(self.uri_for_name(self._manifest_name)))
+
+    def is_unchanged(self, blob, checksums):
+        """
+            Whether the destination blob exists with the same content: composite blobs have no MD5,
+            so their CRC32C is compared instead.
+        """
+        existing_blob = self._bucket.get_blob(blob.name)
+        if existing_blob is None:
+            return False
+        if existing_blob.md5_hash:
+            return existing_blob.md5_hash == checksums.md5_base64
+        return bool(existing_blob.crc32c and checksums.crc32c_base64) and existing_blob.crc32c == checksums.crc32c_base64
+
+    @staticmethod
+    def validate_checksums(blob, checksums):
+        """
+            Compares the checksums returned by GCS once the upload is complete
+            with the ones of the bytes read from the stream.
+        """
+        if blob.md5_hash and blob.md5_hash != checksums.md5_base64:
+            raise ChecksumMismatchError(f"MD5 mismatch for {blob.name}: {blob.md5_hash} != {checksums.md5_base64}")
+        if blob.crc32c and checksums.crc32c_base64 and blob.crc32c != checksums.crc32c_base64:
+            raise ChecksumMismatchError(f"CRC32C mismatch for {blob.name}: {blob.crc32c} != {checksums.crc32c_base64}")
+
     def create_blob(self, name):
         filename = self.path_for_name(name)
         return self._bucket.blob(filename)
@@ -18,23 +18,58 @@
 import click
 import logging
 import os
+import shutil
+import tempfile
 
 from nck.writers.writer import Writer
 from nck.commands.command import processor
+from nck.utils.column_stats import StreamStatistics, STATS_EXTENSION
+
+
+def _read_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# Read once, at import time: reading the umask requires setting it, which would affect
+# the files created by other threads in the meantime
+UMASK = _read_umask()
 
 
 @click.command(name="write_local")
 @click.option("--local-directory", "-d", required=True, help="Destination directory")
 @click.option("--file-name", "-n", help="Destination file name")
+@click.option(
+    "--local-write-stats",
+    is_flag=True,
+    default=False,
+    help="Write per-column statistics of the file in a .stats.json file next to it",
+)
+@click.option(
+    "--local-buffer-size-mb",
+    type=click.INT,
+    default=4,
+    help="Size of the blocks in which the stream is copied to disk, in MiB",
+)
+@click.option(
+    "--local-fsync",
+    is_flag=True,
+    default=False,
+    help="Flush the file to the storage device before making it visible at its destination path",
+)
 @processor()
 def local(**kwargs):
     return LocalWriter(**kwargs)
 
 
 class LocalWriter(Writer):
-    def __init__(self, local_directory, file_name):
+    def __init__(self, local_directory, file_name, local_write_stats=False, local_buffer_size_mb=4, local_fsync=False):
         self._local_directory = local_directory
         self._file_name = file_name
+        self._write_stats = local_write_stats
+        self._buffer_size = local_buffer_size_mb * 1024 * 1024
+        self._fsync = local_fsync
 
     def write(self, stream):
         """
@@ -44,11 +79,37 @@ class LocalWriter(Writer):
         path = os.path.join(self._local_directory, file_name)
 
         logging.info("Writing stream %s to %s", file_name, path)
-        file = stream.as_file()
-        with open(path, "wb") as h:
-            while True:
-                buffer = file.read(1024)
-                if len(buffer) > 0:
-                    h.write(buffer)
-                else:
-                    break
+        stats = StreamStatistics() if self._write_stats else None
+        file = stream.as_file(on_record=stats.update if stats else None)
+        self._write_atomically(path, lambda h: shutil.copyfileobj(file, h, self._buffer_size))
+
+        if stats:
+            self._write_atomically(path + STATS_EXTENSION, lambda h: h.write(stats.to_json().encode()))
+
+    def _write_atomically(self, path, write):
+        """
+            Write to a temporary file of the destination directory, then rename it,
+            so that readers never see a partially written file.
+        """
+        directory, file_name = os.path.split(path)
+        fd, tmp_path = tempfile.mkstemp(prefix=".{}.".format(file_name), suffix=".tmp", dir=directory or ".")
+        try:
+            with open(fd, "wb", buffering=self._buffer_size) as h:
+                # mkstemp creates files readable by their owner only
+                os.fchmod(h.fileno(), 0o666 & ~UMASK)
+                write(h)
+                if self._fsync:
+                    h.flush()
+                    os.fsync(h.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        if self._fsync:
+            # Persist the rename itself
+            dir_fd = os.open(directory or ".", os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
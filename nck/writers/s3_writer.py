@@ -18,10 +18,20 @@
 import logging
 import click
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from nck.writers.writer import Writer
 from nck.commands.command import processor
 from nck.utils.args import extract_args
 from nck.utils.retry import retry
+from nck.utils.column_stats import StreamStatistics, STATS_EXTENSION
+from nck.utils.checksum import StreamChecksums, UploadManifest
+from nck.utils.exceptions import ChecksumMismatchError
+from nck.utils.buffers import spool
+
+# User metadata key storing the MD5 of objects uploaded with --s3-skip-unchanged, whatever their part size
+MD5_METADATA_KEY = "nck-md5"
 
 
 @click.command(name="write_s3")
@@ -33,6 +43,32 @@ from nck.utils.retry import retry
 @click.option(
     "--s3-filename", help="Filename (without prefix). Be sure to add file extension."
 )
+@click.option(
+    "--s3-write-stats",
+    is_flag=True,
+    default=False,
+    help="Write per-column statistics of the file in a .stats.json object next to it",
+)
+@click.option(
+    "--s3-manifest-name",
+    help="Name of a manifest object, written under the prefix at the end of the run, "
+    "listing the uploaded objects with their sizes and checksums",
+)
+@click.option(
+    "--s3-multipart-chunksize-mb",
+    default=8,
+    type=int,
+    help="Size of the parts of multipart uploads, in MB. Files smaller than one part are uploaded in a single request.",
+)
+@click.option("--s3-max-concurrency", default=10, type=int, help="Number of parts uploaded concurrently")
+@click.option("--s3-part-retries", default=5, type=int, help="Number of attempts to upload each part")
+@click.option(
+    "--s3-skip-unchanged",
+    is_flag=True,
+    default=False,
+    help="Spool the file on local disk to compute its checksums, and skip the upload if the destination object "
+    "already has the same content",
+)
 @processor("s3_access_key_id", "s3_access_key_secret")
 def s3(**kwargs):
     return S3Writer(**extract_args("s3_", kwargs))
@@ -40,33 +76,61 @@ def s3(**kwargs):
 
 class S3Writer(Writer):
     def __init__(
-        self, bucket_name, access_key_id, access_key_secret, bucket_region, **kwargs
+        self,
+        bucket_name,
+        access_key_id,
+        access_key_secret,
+        bucket_region,
+        multipart_chunksize_mb=8,
+        max_concurrency=10,
+        part_retries=5,
+        **kwargs,
     ):
+        if kwargs.get("skip_unchanged") and kwargs.get("filename") is None:
+            # Stream names vary between runs (e.g. with dates), so objects would never be compared
+            raise click.BadParameter("--s3-skip-unchanged requires a stable --s3-filename")
         boto_config = {
             "region_name": bucket_region,
             "aws_access_key_id": access_key_id,
             "aws_secret_access_key": access_key_secret,
+            # Each request (e.g. the upload of a single part) is retried on its own
+            "config": Config(retries={"max_attempts": part_retries}),
         }
         self._bucket_name = bucket_name
         self._bucket_region = bucket_region
         self._s3_resource = boto3.resource("s3", **boto_config)
+        self._bucket = None
+        self._multipart_chunksize = multipart_chunksize_mb * 1024 * 1024
+        # Parts of non-seekable streams are buffered in memory: at most 2 parts per concurrent upload
+        self._transfer_config = TransferConfig(
+            multipart_threshold=self._multipart_chunksize,
+            multipart_chunksize=self._multipart_chunksize,
+            max_concurrency=max_concurrency,
+        )
+        self._transfer_config.max_in_memory_upload_chunks = 2 * max_concurrency
         self.kwargs = kwargs
+        self._manifest = UploadManifest()
 
-    @retry
-    def write(self, stream):
+    def get_bucket(self):
+        """
+            Returns the destination bucket, creating it if it doesn't exist.
+            Bucket existence and region are only checked on the first call.
+        """
+        if self._bucket is not None:
+            return self._bucket
 
-        logging.info("Start writing file to S3 ...")
-        bucket = self._s3_resource.Bucket(self._bucket_name)
-
-        if bucket not in self._s3_resource.buckets.all():
+        client = self._s3_resource.meta.client
+        try:
+            client.head_bucket(Bucket=self._bucket_name)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchBucket"):
+                raise
             self._s3_resource.create_bucket(
                 Bucket=self._bucket_name,
                 CreateBucketConfiguration={"LocationConstraint": self._bucket_region},
             )
 
-        bucket_region = self._s3_resource.meta.client.get_bucket_location(
-            Bucket=self._bucket_name
-        )["LocationConstraint"]
+        bucket_region = client.get_bucket_location(Bucket=self._bucket_name)["LocationConstraint"]
 
         # if the bucket region doesn't match the presigned url generated, will not work
         assert (
@@ -74,13 +138,37 @@ class S3Writer(Writer):
         ), "the region you provided ({}) does'nt match the bucket's found region : ({}) ".format(
             self._bucket_region, bucket_region
         )
-        if self.kwargs.get("prefix"):
-            prefix = self.kwargs.get("prefix") + "/"
-        else:
-            prefix = ""
+        self._bucket = self._s3_resource.Bucket(self._bucket_name)
+        return self._bucket
+
+    @retry
+    def write(self, stream):
+
+        logging.info("Start writing file to S3 ...")
+        bucket = self.get_bucket()
+
+        filename = f"{self._get_prefix()}{self.kwargs['filename'] if self.kwargs['filename'] is not None else stream.name}"
+        stats = StreamStatistics() if self.kwargs.get("write_stats") else None
+        checksums = StreamChecksums(part_size=self._multipart_chunksize)
+        file = stream.as_file(on_record=stats.update if stats else None, on_bytes=checksums.update)
+        extra_args = None
+        unchanged = False
+        if self.kwargs.get("skip_unchanged"):
+            file = spool(file)
+            unchanged = self.is_unchanged(bucket.Object(filename), checksums)
+            extra_args = {"Metadata": {MD5_METADATA_KEY: checksums.md5_hex}}
 
-        filename = f"{prefix}{self.kwargs['filename'] if self.kwargs['filename'] is not None else stream.name}"
-        bucket.upload_fileobj(stream.as_file(), filename)
+        if unchanged:
+            logging.info(f"Skipping upload to s3://{self._bucket_name}/{filename}: its content is unchanged")
+        else:
+            bucket.upload_fileobj(file, filename, ExtraArgs=extra_args, Config=self._transfer_config)
+            self.validate_checksums(bucket.Object(filename), checksums, self._multipart_chunksize)
+            if stats:
+                bucket.put_object(
+                    Key=filename + STATS_EXTENSION, Body=stats.to_json().encode("utf-8"), ContentType="application/json"
+                )
+        file.close()
+        self._manifest.add(f"s3://{self._bucket_name}/{filename}", checksums)
         url_file = self._s3_resource.meta.client.generate_presigned_url(
             "get_object",
             Params={"Bucket": self._bucket_name, "Key": stream.name},
@@ -88,3 +176,48 @@ class S3Writer(Writer):
         )
         logging.info(f"file written at location {url_file}")
         return url_file, bucket
+
+    def close(self):
+        manifest_name = self.kwargs.get("manifest_name")
+        if manifest_name and self._manifest.objects:
+            key = f"{self._get_prefix()}{manifest_name}"
+            self.get_bucket().put_object(
+                Key=key, Body=self._manifest.to_json().encode("utf-8"), ContentType="application/json"
+            )
+            logging.info(f"manifest written at s3://{self._bucket_name}/{key}")
+
+    def _get_prefix(self):
+        if self.kwargs.get("prefix"):
+            return self.kwargs.get("prefix") + "/"
+        return ""
+
+    def is_unchanged(self, _object, checksums):
+        """
+            Whether the destination object exists with the same content, according to the MD5
+            stored in its metadata or, failing that, to its ETag.
+        """
+        try:
+            _object.load()
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        if MD5_METADATA_KEY in _object.metadata:
+            return _object.metadata[MD5_METADATA_KEY] == checksums.md5_hex
+        if _object.server_side_encryption == "aws:kms":
+            return False
+        return _object.e_tag.strip('"') == checksums.s3_etag(self._multipart_chunksize)
+
+    @staticmethod
+    def validate_checksums(_object, checksums, multipart_threshold):
+        """
+            Compares the ETag computed by S3 (MD5, or MD5 of part MD5s for multipart uploads)
+            with the one of the bytes read from the stream.
+        """
+        if _object.server_side_encryption == "aws:kms":
+            logging.info(f"Skipping checksum validation of {_object.key}: ETags of SSE-KMS objects are not MD5 digests")
+            return
+        e_tag = _object.e_tag.strip('"')
+        expected_e_tag = checksums.s3_etag(multipart_threshold)
+        if e_tag != expected_e_tag:
+            raise ChecksumMismatchError(f"ETag mismatch for {_object.key}: {e_tag} != {expected_e_tag}")
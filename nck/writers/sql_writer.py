@@ -0,0 +1,222 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import csv
+import datetime
+import io
+import itertools
+import json
+import logging
+import tempfile
+
+import click
+import sqlalchemy
+
+from nck.commands.command import processor
+from nck.utils.args import extract_args
+from nck.utils.sql import get_table, create_table
+from nck.writers.writer import Writer
+
+POSTGRESQL_NULL = "\\N"
+MYSQL_NULL = "\\N"
+
+
+@click.command(name="write_sql")
+@click.option("--sql-drivername", required=True, help="SQLAlchemy driver, e.g. postgresql+psycopg2, mysql+pymysql, sqlite")
+@click.option("--sql-user")
+@click.option("--sql-password")
+@click.option("--sql-host")
+@click.option("--sql-port", type=click.INT)
+@click.option("--sql-database", required=True)
+@click.option("--sql-schema")
+@click.option("--sql-table", required=True)
+@click.option("--sql-batch-size", type=click.INT, default=10000, help="Number of rows sent to the database at once")
+@click.option(
+    "--sql-load-method",
+    type=click.Choice(["insert", "bulk"]),
+    default="insert",
+    help="insert: batched INSERT statements. bulk: COPY FROM STDIN (PostgreSQL) or LOAD DATA LOCAL INFILE (MySQL)",
+)
+@processor("sql_password")
+def sql(**kwargs):
+    return SQLWriter(**extract_args("sql_", kwargs))
+
+
+def infer_column_type(values):
+    """
+        Return the SQLAlchemy type able to store every non-null value of a column.
+    """
+    types = {type(value) for value in values if value is not None}
+    if not types:
+        return sqlalchemy.Text
+    if types == {bool}:
+        return sqlalchemy.Boolean
+    if types == {int}:
+        return sqlalchemy.BigInteger
+    if types <= {int, float}:
+        return sqlalchemy.Float
+    if types == {datetime.datetime}:
+        return sqlalchemy.DateTime
+    if types == {datetime.date}:
+        return sqlalchemy.Date
+    return sqlalchemy.Text
+
+
+def to_sql_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return value
+
+
+class SQLWriter(Writer):
+    BULK_DIALECTS = ("postgresql", "mysql")
+
+    def __init__(
+        self,
+        drivername,
+        database,
+        table,
+        user=None,
+        password=None,
+        host=None,
+        port=None,
+        schema=None,
+        batch_size=10000,
+        load_method="insert",
+    ):
+        url = sqlalchemy.engine.url.URL(
+            **{
+                "drivername": drivername,
+                "username": user,
+                "password": password,
+                "database": database,
+                "port": port,
+                "host": host,
+            }
+        )
+        dialect = url.get_dialect().name
+        if load_method == "bulk" and dialect not in self.BULK_DIALECTS:
+            raise click.BadParameter("Bulk loads are only available for {}".format(", ".join(self.BULK_DIALECTS)))
+
+        connect_args = {"local_infile": True} if load_method == "bulk" and dialect == "mysql" else {}
+        logging.info("Connecting to %s database %s on %s:%s", dialect, database, host, port)
+        self._engine = sqlalchemy.create_engine(url, connect_args=connect_args)
+        self._dialect = dialect
+        self._schema = schema
+        self._table_name = table
+        self._batch_size = batch_size
+        self._load_method = load_method
+        self._table = None
+
+    def write(self, stream):
+        records = iter(stream)
+        batch = list(itertools.islice(records, self._batch_size))
+        if not batch:
+            logging.info("Stream %s is empty, nothing to write", stream.name)
+            return
+
+        table = self._get_or_create_table(batch)
+        columns = [column.name for column in table.columns]
+        logging.info("Writing stream %s to %s table %s", stream.name, self._dialect, table.fullname)
+
+        row_count = 0
+        with self._engine.begin() as connection:
+            while batch:
+                rows = [[to_sql_value(record.get(column)) for column in columns] for record in batch]
+                if self._load_method == "bulk" and self._dialect == "postgresql":
+                    self._copy_rows(connection, table, columns, rows)
+                elif self._load_method == "bulk":
+                    self._load_data_rows(connection, table, columns, rows)
+                else:
+                    connection.execute(table.insert(), [dict(zip(columns, row)) for row in rows])
+                row_count += len(rows)
+                batch = list(itertools.islice(records, self._batch_size))
+
+        logging.info("%d rows written to %s", row_count, table.fullname)
+
+    def _get_or_create_table(self, records):
+        if self._table is None:
+            try:
+                self._table = get_table(self._engine, self._schema, self._table_name)
+            except sqlalchemy.exc.NoSuchTableError:
+                column_names = list(dict.fromkeys(key for record in records for key in record))
+                columns = [
+                    sqlalchemy.Column(name, infer_column_type([record.get(name) for record in records]))
+                    for name in column_names
+                ]
+                logging.info("Creating table %s with columns %s", self._table_name, column_names)
+                self._table = create_table(self._engine, self._schema, self._table_name, columns)
+        return self._table
+
+    @staticmethod
+    def _copy_rows(connection, table, columns, rows):
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write(",".join(map(SQLWriter._postgresql_value, row)) + "\n")
+        buffer.seek(0)
+
+        statement = "COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '{}')".format(
+            SQLWriter._quote_table(connection, table),
+            ", ".join(connection.dialect.identifier_preparer.quote(column) for column in columns),
+            POSTGRESQL_NULL,
+        )
+        with connection.connection.cursor() as cursor:
+            cursor.copy_expert(statement, buffer)
+
+    @staticmethod
+    def _postgresql_value(value):
+        # In CSV format, COPY only reads unquoted values as NULL: every other value is quoted,
+        # so that a "\N" string is not loaded as NULL
+        if value is None:
+            return POSTGRESQL_NULL
+        return '"{}"'.format(str(value).replace('"', '""'))
+
+    @staticmethod
+    def _load_data_rows(connection, table, columns, rows):
+        with tempfile.NamedTemporaryFile("w", newline="", suffix=".csv") as file:
+            writer = csv.writer(file, lineterminator="\n")
+            writer.writerows([SQLWriter._mysql_value(value) for value in row] for row in rows)
+            file.flush()
+
+            statement = (
+                "LOAD DATA LOCAL INFILE %s INTO TABLE {} FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+                "LINES TERMINATED BY '\\n' ({})"
+            ).format(
+                SQLWriter._quote_table(connection, table),
+                ", ".join(connection.dialect.identifier_preparer.quote(column) for column in columns),
+            )
+            with connection.connection.cursor() as cursor:
+                cursor.execute(statement, (file.name,))
+
+    @staticmethod
+    def _mysql_value(value):
+        # LOAD DATA reads \N as NULL, and backslash is its escape character
+        if value is None:
+            return MYSQL_NULL
+        if isinstance(value, bool):
+            return int(value)
+        if isinstance(value, str):
+            return value.replace("\\", "\\\\")
+        return value
+
+    @staticmethod
+    def _quote_table(connection, table):
+        return connection.dialect.identifier_preparer.format_table(table)
+
+    def close(self):
+        logging.info("Closing %s connection", self._dialect)
+        self._engine.dispose()
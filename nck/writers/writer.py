@@ -20,3 +20,9 @@
 class Writer(object):
     def write(self, stream):
         raise NotImplementedError
+
+    def close(self):
+        """
+            Called once every stream yielded by the reader has been written.
+        """
+        pass
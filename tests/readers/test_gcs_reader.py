@@ -0,0 +1,45 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import unittest
+from unittest import mock
+
+from nck.readers.gcs_reader import GCSReader
+
+
+class TestGCSReader(unittest.TestCase):
+    def test_download_range_is_pinned_to_the_listed_generation(self):
+        blob = mock.MagicMock(generation=42)
+        blob.name = "prefix/a.csv"
+        pinned_blob = blob.bucket.blob.return_value
+        pinned_blob.download_as_string.return_value = b"abc"
+
+        self.assertEqual(GCSReader.download_range(blob, 10, 13), b"abc")
+        blob.bucket.blob.assert_called_once_with("prefix/a.csv", generation=42)
+        pinned_blob.download_as_string.assert_called_once_with(start=10, end=12)
+
+    def test_list_objects_after_a_key(self):
+        bucket = mock.MagicMock()
+        blobs = [mock.MagicMock() for _ in range(3)]
+        for blob, name in zip(blobs, ["prefix/2020-01-01.csv", "prefix/2020-01-02.csv", "prefix/2020-01-03.csv"]):
+            blob.name = name
+        bucket.list_blobs.return_value = iter(blobs)
+
+        listed = GCSReader.list_objects(None, bucket, "prefix/", start_after="prefix/2020-01-02.csv")
+        self.assertEqual(list(listed), blobs[2:])
+        # google-cloud-storage 1.23.0 has no start_offset argument
+        bucket.list_blobs.assert_called_once_with(prefix="prefix/")
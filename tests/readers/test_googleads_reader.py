@@ -21,6 +21,7 @@ import datetime
 from click import ClickException
 
 from nck.readers.googleads_reader import GoogleAdsReader, DATEFORMAT
+from nck.streams.record_batch import RecordBatch
 from nck.helpers.googleads_helper import DATE_RANGE_TYPE_POSSIBLE_VALUES
 
 
@@ -145,6 +146,25 @@ class GoogleAdsReaderTest(TestCase):
             for record, output in zip(data.readlines(), iter(expected)):
                 assert record == output
 
+    @mock.patch("nck.readers.googleads_reader.GoogleAdsReader.fetch_report_from_gads_client_customer_obj")
+    @mock.patch("nck.readers.googleads_reader.codecs.getreader", side_effect=mock_query)
+    @mock.patch.object(GoogleAdsReader, "__init__", mock_googleads_reader)
+    def test_format_and_yield_record_batches(self, mock_report, mock_query):
+        temp_kwargs = self.kwargs.copy()
+        temp_kwargs.update({'include_client_customer_id': True})
+        reader = GoogleAdsReader(**temp_kwargs)
+        reader.get_report_definition = lambda: {}
+
+        batches = list(reader.format_and_yield())
+        self.assertIsInstance(batches[0], RecordBatch)
+        self.assertEqual(
+            [record for batch in batches for record in batch],
+            [
+                {"CampaignId": "ad_group_example", "Date": "2019-01-01", "Impressions": "0", "AccountId": "123-456-7890"},
+                {"CampaignId": "ad_group_example", "Date": "2019-01-01", "Impressions": "4", "AccountId": "123-456-7890"},
+            ]
+        )
+
     @mock.patch("nck.readers.googleads_reader.GoogleAdsReader.fetch_report_from_gads_client_customer_obj")
     @mock.patch("nck.readers.googleads_reader.codecs.getreader", side_effect=mock_video_query)
     @mock.patch.object(GoogleAdsReader, "__init__", mock_googleads_reader)
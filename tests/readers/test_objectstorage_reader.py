@@ -0,0 +1,246 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import io
+import os
+import tempfile
+import time
+import unittest
+from collections import namedtuple
+from unittest import mock
+
+from nck.readers.objectstorage_reader import ObjectStorageReader
+from nck.utils.buffers import ReadableStream
+
+FakeObject = namedtuple("FakeObject", ["key", "timestamp", "data"])
+
+
+class FakeStateService:
+    enabled = True
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        self.values[key] = value
+
+    def get_set(self, key):
+        return set(self.values.get(key, set()))
+
+    def add_to_set(self, key, *members):
+        self.values.setdefault(key, set()).update(members)
+
+    def set_many(self, values, replaced_sets=None):
+        self.values.update(values)
+        self.values.update({key: set(members) for key, members in (replaced_sets or {}).items()})
+
+
+class FakeObjectStorageReader(ObjectStorageReader):
+    def __init__(self, objects, **kwargs):
+        self.objects = objects
+        self.downloaded = []
+        self.opened = []
+        self.ranges = []
+        self.listed = []
+        super().__init__("bucket", ["prefix"], "csv", -1, platform="FAKE", csv_delimiter=",", csv_fieldnames=None, **kwargs)
+
+    def create_client(self, config):
+        return None
+
+    def create_bucket(self, client, bucket):
+        return bucket
+
+    def list_objects(self, bucket, prefix, start_after=None):
+        self.listed.append((prefix, start_after))
+        return [_object for _object in self.objects if _object.key.startswith(prefix) and _object.key > (start_after or "")]
+
+    @staticmethod
+    def get_timestamp(_object):
+        return _object.timestamp
+
+    @staticmethod
+    def get_key(_object):
+        return _object.key
+
+    @staticmethod
+    def to_object(_object):
+        return _object
+
+    def download_object_to_file(self, _object, temp):
+        self.downloaded.append(_object.key)
+        temp.write(_object.data)
+
+    @staticmethod
+    def get_size(_object):
+        return len(_object.data)
+
+    def download_range(self, _object, start, end):
+        self.ranges.append((start, end))
+        return _object.data[start:end]
+
+    def open_object(self, _object):
+        self.opened.append(_object.key)
+        return io.BufferedReader(ReadableStream(io.BytesIO(_object.data)))
+
+
+class TestObjectStorageReader(unittest.TestCase):
+    objects = [
+        FakeObject("prefix/b.csv", 2, b"a,b\n3,4\n"),
+        FakeObject("prefix/a.csv", 1, b"a,b\n1,2\n"),
+        FakeObject("prefix/c.json", 3, b"{}"),
+        FakeObject("prefix/d.csv", 3, b"a,b\n5,6\n"),
+    ]
+
+    def setUp(self):
+        self.state = FakeStateService()
+        patcher = mock.patch.object(ObjectStorageReader, "state", new_callable=mock.PropertyMock)
+        patcher.start().return_value = self.state
+        self.addCleanup(patcher.stop)
+
+    def read_all(self, reader):
+        return {stream.name: [dict(record) for record in stream] for stream in reader.read()}
+
+    def test_read(self):
+        reader = FakeObjectStorageReader(self.objects)
+        streams = self.read_all(reader)
+
+        self.assertEqual(
+            [name.split("_")[0] for name in streams], ["a.csv", "b.csv", "d.csv"]
+        )
+        self.assertEqual(list(streams.values())[0], [{"a": "1", "b": "2"}])
+        self.assertEqual(self.state.values, {"fake_max_timestamp": 3, "fake_max_files_set": {"prefix/d.csv"}})
+        self.assertEqual(reader.opened, ["prefix/a.csv", "prefix/b.csv", "prefix/d.csv"])
+        self.assertEqual(reader.downloaded, [])
+
+        self.assertEqual(self.read_all(FakeObjectStorageReader(self.objects)), {})
+
+    def test_read_with_prefetch(self):
+        reader = FakeObjectStorageReader(self.objects, prefetch_objects=2)
+        streams = reader.read()
+
+        first_stream = next(streams)
+        [dict(record) for record in first_stream]
+        # The next objects are downloaded in the background, without waiting for their streams to be read
+        deadline = time.time() + 5
+        while len(reader.downloaded) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(sorted(reader.downloaded), ["prefix/a.csv", "prefix/b.csv", "prefix/d.csv"])
+        self.assertEqual(self.state.values["fake_max_timestamp"], 1)
+
+        records = [[dict(record) for record in stream] for stream in streams]
+        self.assertEqual(records, [[{"a": "3", "b": "4"}], [{"a": "5", "b": "6"}]])
+        self.assertEqual(self.state.values, {"fake_max_timestamp": 3, "fake_max_files_set": {"prefix/d.csv"}})
+
+    def test_sliced_download(self):
+        data = b"a,b\n" + b"".join(b"%d,%d\n" % (i, i) for i in range(100))
+        reader = FakeObjectStorageReader([FakeObject("prefix/big.csv", 1, data)], download_slices=3)
+        reader._slice_size = 50
+
+        records = [dict(record) for stream in reader.read() for record in stream]
+        self.assertEqual(len(records), 100)
+        self.assertEqual(records[-1], {"a": "99", "b": "99"})
+        self.assertEqual(sorted(reader.ranges), [(start, min(start + 50, len(data))) for start in range(0, len(data), 50)])
+        self.assertEqual(reader.opened, [])
+
+    def test_time_ordered_keys(self):
+        objects = [FakeObject("prefix/2020-01-01.csv", 1, b"a\n1\n"), FakeObject("prefix/2020-01-02.csv", 2, b"a\n2\n")]
+        reader = FakeObjectStorageReader(objects, time_ordered_keys=True)
+        self.assertEqual(len(self.read_all(reader)), 2)
+        self.assertEqual(reader.listed, [("prefix", None)])
+        self.assertEqual(self.state.values["fake_last_keys"], {"prefix": "prefix/2020-01-02.csv"})
+
+        objects.append(FakeObject("prefix/2020-01-03.csv", 3, b"a\n3\n"))
+        reader = FakeObjectStorageReader(objects, time_ordered_keys=True)
+        self.assertEqual([name.split("_")[0] for name in self.read_all(reader)], ["2020-01-03.csv"])
+        self.assertEqual(reader.listed, [("prefix", "prefix/2020-01-02.csv")])
+
+    def test_listing_index(self):
+        self.state.enabled = False
+        objects = [FakeObject("prefix/2020-01-01.csv", 1, b"a\n1\n")]
+        with tempfile.TemporaryDirectory() as directory:
+            index = os.path.join(directory, "index.json")
+            self.read_all(FakeObjectStorageReader(objects, time_ordered_keys=True, listing_index=index))
+
+            reader = FakeObjectStorageReader(objects, time_ordered_keys=True, listing_index=index)
+            self.read_all(reader)
+            self.assertEqual(reader.listed, [("prefix", "prefix/2020-01-01.csv")])
+
+    def test_files_with_same_timestamp(self):
+        objects = [FakeObject("prefix/{}.csv".format(i), 1, b"a\n1\n") for i in range(3)]
+        self.read_all(FakeObjectStorageReader(objects[:2]))
+        self.assertEqual(self.state.values["fake_max_files_set"], {"prefix/0.csv", "prefix/1.csv"})
+
+        streams = self.read_all(FakeObjectStorageReader(objects))
+        self.assertEqual([name.split("_")[0] for name in streams], ["2.csv"])
+        self.assertEqual(len(self.state.values["fake_max_files_set"]), 3)
+
+    def test_legacy_checkpoint_is_migrated(self):
+        self.state.values = {"fake_max_timestamp": 1, "fake_max_files": ["prefix/0.csv"]}
+        objects = [FakeObject("prefix/0.csv", 1, b"a\n1\n"), FakeObject("prefix/1.csv", 1, b"a\n1\n")]
+
+        streams = self.read_all(FakeObjectStorageReader(objects))
+        self.assertEqual([name.split("_")[0] for name in streams], ["1.csv"])
+        self.assertEqual(self.state.values["fake_max_files_set"], {"prefix/0.csv", "prefix/1.csv"})
+
+    def test_coalesce(self):
+        objects = [FakeObject("prefix/{}.csv".format(i), i + 1, b"a\n%d\n" % i) for i in range(5)]
+        reader = FakeObjectStorageReader(objects, coalesce_max_files=2, coalesce_max_bytes=12)
+        streams = reader.read()
+
+        first_stream = next(streams)
+        self.assertEqual(first_stream.name.split("_")[0], "0.csv")
+        self.assertEqual([dict(record) for record in first_stream], [{"a": "0"}, {"a": "1"}])
+        # Both objects are checkpointed once the merged stream is read
+        self.assertEqual(self.state.values["fake_max_timestamp"], 2)
+
+        streams = {stream.name.split("_")[0]: [dict(record) for record in stream] for stream in streams}
+        self.assertEqual(streams, {"2.csv": [{"a": "2"}, {"a": "3"}], "4.csv": [{"a": "4"}]})
+        self.assertEqual(self.state.values["fake_max_files_set"], {"prefix/4.csv"})
+
+        reader = FakeObjectStorageReader(objects, coalesce_max_bytes=3)
+        self.state.values = {}
+        self.assertEqual(len(self.read_all(reader)), 5)
+
+    def test_coalesce_with_prefetch(self):
+        objects = [FakeObject("prefix/{}.csv".format(i), i + 1, b"a\n%d\n" % i) for i in range(20)]
+        reader = FakeObjectStorageReader(objects, coalesce_max_bytes=1000, prefetch_objects=2)
+        open_files = []
+        read_object = reader.read_object
+
+        def download_object(_object):
+            # Prefetched files count as open until their stream reads and closes them
+            file = read_object(_object)
+            open_files.append(file)
+            return file
+
+        reader.download_object = download_object
+        streams = list(reader.read())
+        self.assertEqual(len(streams), 1)
+        self.assertEqual(reader.opened, [])
+
+        records = []
+        max_open_files = 0
+        for record in streams[0]:
+            records.append(dict(record))
+            max_open_files = max(max_open_files, len([file for file in open_files if not file.closed]))
+        self.assertEqual(records, [{"a": str(i)} for i in range(20)])
+        # The group holds 20 objects, but at most prefetch_objects + 1 of them are downloaded at once
+        self.assertLessEqual(max_open_files, 3)
+        self.assertEqual(len(open_files), 20)
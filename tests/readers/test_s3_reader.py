@@ -0,0 +1,31 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import io
+import unittest
+from unittest import mock
+
+from nck.readers.s3_reader import S3Reader
+
+
+class TestS3Reader(unittest.TestCase):
+    def test_download_range_is_pinned_to_the_listed_version(self):
+        _object = mock.MagicMock(e_tag='"etag"')
+        _object.get.return_value = {"Body": io.BytesIO(b"abc")}
+
+        self.assertEqual(S3Reader.download_range(_object, 10, 13), b"abc")
+        _object.get.assert_called_once_with(Range="bytes=10-12", IfMatch='"etag"')
@@ -24,6 +24,7 @@ from datetime import datetime
 from twitter_ads.client import Client
 
 from nck.readers.twitter_reader import TwitterReader
+from nck.streams.record_batch import RecordBatch
 
 
 class TwitterReaderTest(TestCase):
@@ -172,7 +173,11 @@ class TwitterReaderTest(TestCase):
                 },
             ],
         }
-        output = TwitterReader(**temp_kwargs).parse(raw_analytics_response)
+        output = [
+            record
+            for batch in TwitterReader(**temp_kwargs).parse(raw_analytics_response)
+            for record in batch
+        ]
         expected = [
             {"id": "XXXXX", "retweets": 11, "likes": 12},
             {"id": "YYYYY", "retweets": 21, "likes": 22},
@@ -220,7 +225,11 @@ class TwitterReaderTest(TestCase):
                 },
             ],
         }
-        output = TwitterReader(**temp_kwargs).parse(raw_analytics_response)
+        output = [
+            record
+            for batch in TwitterReader(**temp_kwargs).parse(raw_analytics_response)
+            for record in batch
+        ]
         expected = [
             {"date": "2020-01-01", "id": "XXXXX", "retweets": 11, "likes": 14},
             {"date": "2020-01-02", "id": "XXXXX", "retweets": 12, "likes": 15},
@@ -269,7 +278,11 @@ class TwitterReaderTest(TestCase):
                 },
             ],
         }
-        output = TwitterReader(**temp_kwargs).parse(raw_analytics_response)
+        output = [
+            record
+            for batch in TwitterReader(**temp_kwargs).parse(raw_analytics_response)
+            for record in batch
+        ]
         expected = [
             {"id": "XXXXX", "gender": "Male", "retweets": 11, "likes": 12},
             {"id": "XXXXX", "gender": "Female", "retweets": 13, "likes": 14},
@@ -303,6 +316,10 @@ class TwitterReaderTest(TestCase):
         }
         self.assertEqual(output, expected)
 
+        batch = RecordBatch(["id", "name"], [("XXXXX", "Artefact Campaign")])
+        output = TwitterReader(**temp_kwargs).add_request_or_period_dates(batch)
+        self.assertEqual(list(output), [expected])
+
     def mock_get_job_result(*args):
         job_result = mock.MagicMock()
         job_result.status = "SUCCESS"
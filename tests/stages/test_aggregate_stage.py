@@ -0,0 +1,75 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import unittest
+from unittest import mock
+
+from nck.stages.aggregate_stage import SPILL_PARTITIONS, AggregateStage, to_number
+from nck.utils.spill import SpillFile
+from nck.streams.json_stream import JSONStream
+
+
+class TestAggregateStage(unittest.TestCase):
+    @staticmethod
+    def records():
+        for i in range(1000):
+            yield {
+                "date": f"2020-01-0{i % 3 + 1}",
+                "campaign_id": str(i % 10),
+                "segment": str(i),
+                "impressions": "10",
+                "spend": "0.5",
+            }
+
+    @staticmethod
+    def by_key(records):
+        return {(record["date"], record["campaign_id"]): record for record in records}
+
+    def test_to_number(self):
+        self.assertEqual(to_number("12"), 12)
+        self.assertEqual(to_number("1.5"), 1.5)
+        self.assertEqual(to_number(""), 0)
+        self.assertEqual(to_number(None), 0)
+        self.assertEqual(to_number(3), 3)
+
+    def test_values_that_are_not_numbers_fail_with_their_field(self):
+        records = [{"date": "2020-01-01", "spend": "1.5"}, {"date": "2020-01-01", "spend": "1,234"}]
+        stage = AggregateStage(group_by=["date"], sum_fields=["spend"])
+        stage._memory_bytes = 1
+        with mock.patch.object(SpillFile, "close", autospec=True, side_effect=SpillFile.close) as close:
+            with self.assertRaisesRegex(ValueError, "Field spend: '1,234' is not a number"):
+                list(stage.aggregate_records(records))
+        self.assertEqual(close.call_count, SPILL_PARTITIONS)
+
+    def test_aggregate_in_memory(self):
+        stream = JSONStream("test", self.records())
+        stage = AggregateStage(group_by=["date", "campaign_id"], sum_fields=["impressions", "spend"])
+        records = [record for record in stage.process(stream)]
+
+        self.assertEqual(len(records), 30)
+        self.assertEqual(sum(record["impressions"] for record in records), 10000)
+        self.assertNotIn("segment", records[0])
+
+    def test_aggregate_with_spilled_partitions(self):
+        in_memory = AggregateStage(group_by=["date", "campaign_id"], sum_fields=["impressions", "spend"])
+        spilled = AggregateStage(group_by=["date", "campaign_id"], sum_fields=["impressions", "spend"])
+        spilled._memory_bytes = 1000
+
+        self.assertEqual(
+            self.by_key(spilled.aggregate_records(self.records())),
+            self.by_key(in_memory.aggregate_records(self.records())),
+        )
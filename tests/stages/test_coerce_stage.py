@@ -0,0 +1,76 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import unittest
+from datetime import date
+
+from parameterized import parameterized
+
+from nck.stages.coerce_stage import CoerceStage, infer_type
+from nck.streams.json_stream import JSONStream
+
+
+class TestCoerceStage(unittest.TestCase):
+    @parameterized.expand(
+        [
+            (["1", "-2", "", "30"], "int"),
+            (["1", "2.5", "1e3"], "float"),
+            (["TRUE", "false"], "bool"),
+            (["2020-01-01", "2020-12-31"], "date"),
+            (["0012", "1234"], None),
+            (["1", "abc"], None),
+            (["", None], None),
+            ([1, 2], None),
+        ]
+    )
+    def test_infer_type(self, values, expected):
+        self.assertEqual(infer_type(values), expected)
+
+    def test_coerce_records(self):
+        records = [
+            {"date": "2020-01-01", "impressions": "10", "spend": "1.5", "active": "true", "name": "a"},
+            {"date": "2020-01-02", "impressions": "", "spend": "2", "active": "false", "name": "b"},
+            {"date": "2020-01-03", "impressions": "30", "spend": "0.1", "active": "true", "name": "c"},
+        ]
+        stream = JSONStream("test", iter(records))
+        coerced = [record for record in CoerceStage(sample_size=2).process(stream)]
+
+        self.assertEqual(
+            coerced[1], {"date": date(2020, 1, 2), "impressions": None, "spend": 2.0, "active": False, "name": "b"}
+        )
+        self.assertEqual(coerced[2]["impressions"], 30)
+
+    def test_integer_columns_are_widened_to_float(self):
+        records = [{"impressions": "10"}, {"impressions": "2.5"}, {"impressions": "3"}]
+        coerced = list(CoerceStage(sample_size=1).coerce_records(records))
+
+        self.assertEqual(coerced, [{"impressions": 10}, {"impressions": 2.5}, {"impressions": 3.0}])
+        self.assertIsInstance(coerced[2]["impressions"], float)
+
+    def test_values_that_cannot_be_converted_fail_by_default(self):
+        records = [{"impressions": "10"}, {"impressions": "n/a"}]
+        with self.assertRaisesRegex(ValueError, "Column impressions: 'n/a'"):
+            list(CoerceStage(sample_size=1).coerce_records(records))
+
+    def test_values_that_cannot_be_converted_can_be_set_to_null(self):
+        records = [{"impressions": "10"}, {"impressions": "n/a"}, {"impressions": "-"}]
+        with self.assertLogs(level="WARNING") as logs:
+            coerced = list(CoerceStage(sample_size=1, null_invalid=True).coerce_records(records))
+
+        self.assertEqual(coerced, [{"impressions": 10}, {"impressions": None}, {"impressions": None}])
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("2 values could not be converted to int", logs.output[0])
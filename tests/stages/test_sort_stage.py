@@ -0,0 +1,63 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import random
+import unittest
+
+from nck.stages.sort_stage import SortStage
+from nck.streams.json_stream import JSONStream
+
+
+class TestSortStage(unittest.TestCase):
+    @staticmethod
+    def records(n):
+        values = list(range(n))
+        random.Random(42).shuffle(values)
+        return [{"id": value, "name": f"record_{value}"} for value in values]
+
+    def test_sort_in_memory(self):
+        stream = JSONStream("test", iter(self.records(100)))
+        sorted_stream = SortStage(by=["id"]).process(stream)
+
+        self.assertEqual(sorted_stream.name, stream.name)
+        self.assertEqual([record["id"] for record in sorted_stream], list(range(100)))
+
+    def test_sort_with_spilled_runs(self):
+        stage = SortStage(by=["id"], memory_mb=0)
+        stage._memory_bytes = 5000
+
+        self.assertEqual([record["id"] for record in stage.sort_records(self.records(1000))], list(range(1000)))
+
+    def test_sort_descending_on_several_fields(self):
+        records = [
+            {"date": "2020-01-01", "id": 1},
+            {"date": "2020-01-02", "id": 1},
+            {"date": "2020-01-01", "id": 2},
+            {"date": None, "id": 3},
+        ]
+        stage = SortStage(by=["id", "date"], descending=True)
+        stage._memory_bytes = 1
+
+        self.assertEqual(
+            list(stage.sort_records(records)),
+            [
+                {"date": None, "id": 3},
+                {"date": "2020-01-01", "id": 2},
+                {"date": "2020-01-02", "id": 1},
+                {"date": "2020-01-01", "id": 1},
+            ],
+        )
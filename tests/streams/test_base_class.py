@@ -16,6 +16,8 @@
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 import unittest
+from nck.streams.json_stream import JSONStream
+from nck.streams.record_batch import RecordBatch
 from nck.streams.stream import Stream
 
 
@@ -106,3 +108,44 @@ class TestsWithImplementedMethods(unittest.TestCase):
         string_arrray = bytes_array.decode("utf-8")
         res = string_arrray.split("\n")
         assert int(res[10]) == 10 ** 2
+
+
+class TestParallelEncoding(unittest.TestCase):
+    def tearDown(self) -> None:
+        del JSONStream.encoding_workers
+        del JSONStream.encoding_chunk_size
+
+    def test_parallel_encoding_keeps_records_order(self):
+        records = [{"id": i, "name": f"record_{i}"} for i in range(1000)]
+        expected = JSONStream("test", iter(records)).as_file().read()
+
+        JSONStream.encoding_workers = 2
+        JSONStream.encoding_chunk_size = 7
+        file = JSONStream("test", iter(records)).as_file()
+        result = b""
+        buffer = file.read(100)
+        while buffer:
+            result += buffer
+            buffer = file.read(100)
+
+        assert result == expected
+
+    def test_parallel_encoding_chunks_count_batch_records(self):
+        items = [RecordBatch(["id"], [(i,) for i in range(25)]), {"id": 25}, RecordBatch(["id"], [(26,), (27,)])]
+        chunks = list(JSONStream._iter_chunks(iter(items), 10))
+        assert [sum(len(item) if isinstance(item, RecordBatch) else 1 for item in chunk) for chunk in chunks] == [
+            10,
+            10,
+            8,
+        ]
+
+        JSONStream.encoding_workers = 2
+        JSONStream.encoding_chunk_size = 10
+        expected = b"".join(b'{"id": %d}\n' % i for i in range(28))
+        assert JSONStream("test", iter(items)).as_file().read() == expected
+
+
+class TestReadAsFile(unittest.TestCase):
+    def test_empty_chunks_are_not_read_as_end_of_file(self):
+        records = [{"id": 1}, RecordBatch(["id"], []), {"id": 2}]
+        assert JSONStream("test", iter(records)).as_file().read() == b'{"id": 1}\n{"id": 2}\n'
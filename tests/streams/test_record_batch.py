@@ -0,0 +1,67 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import json
+import unittest
+
+from nck.streams.json_stream import JSONStream
+from nck.streams.normalized_json_stream import NormalizedJSONStream
+from nck.streams.record_batch import RecordBatch, ValueInterner
+
+
+class TestRecordBatch(unittest.TestCase):
+    headers = ["Date", "Campaign Name", "Impressions", "Labels"]
+    rows = [
+        ("2020-01-01", "Campagne d'été", 10, ["a", "b"]),
+        ("2020-01-02", None, 2.5, {"key": "value"}),
+    ]
+
+    def records(self):
+        return [dict(zip(self.headers, row)) for row in self.rows]
+
+    def test_iterate_as_dicts(self):
+        self.assertEqual(list(RecordBatch(self.headers, self.rows)), self.records())
+
+    def test_stream_iteration_flattens_batches(self):
+        stream = JSONStream("test", iter([RecordBatch(self.headers, self.rows), {"Date": "2020-01-03"}]))
+        self.assertEqual([record for record in stream], self.records() + [{"Date": "2020-01-03"}])
+
+    def test_json_encoding_matches_record_encoding(self):
+        batch_content = JSONStream("test", iter([RecordBatch(self.headers, self.rows)])).as_file().read()
+        records_content = JSONStream("test", iter(self.records())).as_file().read()
+
+        self.assertEqual(batch_content, records_content)
+
+    def test_json_encoding_of_non_string_keys(self):
+        batch = RecordBatch(["a", None, 1, True], [("x", ["extra"], 2, 3)])
+        batch_content = JSONStream("test", iter([batch])).as_file().read()
+        records_content = JSONStream("test", iter(list(batch))).as_file().read()
+
+        self.assertEqual(batch_content, records_content)
+
+    def test_normalized_json_encoding(self):
+        content = NormalizedJSONStream("test", iter([RecordBatch(self.headers, self.rows)])).as_file().read()
+        first_record = json.loads(content.decode("utf-8").split("\n")[0])
+
+        self.assertIn("Campaign_Name", first_record)
+
+    def test_value_interner(self):
+        interner = ValueInterner(max_size=2)
+        first, second = "".join(["camp", "aign"]), "".join(["camp", "aign"])
+
+        self.assertIsNot(first, second)
+        self.assertIs(interner(first), interner(second))
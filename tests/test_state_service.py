@@ -0,0 +1,52 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import pickle
+import unittest
+from unittest import mock
+
+from nck.state_service import StateService
+
+
+@mock.patch("nck.state_service.redis.Redis")
+class TestStateService(unittest.TestCase):
+    def test_sets(self, mock_redis):
+        client = mock_redis.return_value
+        state = StateService("run", "localhost")
+
+        state.add_to_set("files", "a.csv")
+        client.sadd.assert_called_once_with("run:files", pickle.dumps("a.csv"))
+
+        client.smembers.return_value = {pickle.dumps("a.csv"), pickle.dumps("b.csv")}
+        self.assertEqual(state.get_set("files"), {"a.csv", "b.csv"})
+
+    def test_set_many_is_a_single_round_trip(self, mock_redis):
+        pipeline = mock_redis.return_value.pipeline.return_value
+        StateService("run", "localhost").set_many({"max_timestamp": 2}, replaced_sets={"files": ["c.csv"]})
+
+        pipeline.hset.assert_called_once_with("run", "max_timestamp", pickle.dumps(2))
+        pipeline.delete.assert_called_once_with("run:files")
+        pipeline.sadd.assert_called_once_with("run:files", pickle.dumps("c.csv"))
+        pipeline.execute.assert_called_once()
+
+    def test_disabled(self, mock_redis):
+        state = StateService("run", None)
+        state.add_to_set("files", "a.csv")
+        state.set_many({"max_timestamp": 2})
+
+        self.assertEqual(state.get_set("files"), set())
+        mock_redis.assert_not_called()
@@ -0,0 +1,54 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import gzip
+import io
+import unittest
+
+from nck.utils.buffers import RangeReader, ReadableStream
+
+
+class TestRangeReader(unittest.TestCase):
+    data = b"".join(b"line %d\n" % i for i in range(1000))
+
+    def test_read_lines(self):
+        ranges = []
+
+        def fetch_range(start, end):
+            ranges.append((start, end))
+            return self.data[start:end]
+
+        reader = io.BufferedReader(RangeReader(fetch_range, len(self.data), chunk_size=1000))
+        self.assertEqual(list(reader), self.data.splitlines(keepends=True))
+        self.assertEqual(ranges[0], (0, 1000))
+        self.assertEqual(ranges[-1][1], len(self.data))
+
+    def test_empty_object(self):
+        reader = RangeReader(lambda start, end: self.fail("No range should be fetched"), 0, chunk_size=1000)
+        self.assertEqual(reader.read(), b"")
+
+
+class TestReadableStream(unittest.TestCase):
+    def test_gzip_decompression(self):
+        data = b"a,b\n1,2\n"
+        body = io.BytesIO(gzip.compress(data))
+        stream = io.BufferedReader(ReadableStream(body))
+
+        self.assertFalse(stream.seekable())
+        self.assertEqual(gzip.GzipFile(mode="rb", fileobj=stream).read(), data)
+        stream.close()
+        self.assertTrue(body.closed)
@@ -0,0 +1,54 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import hashlib
+import unittest
+
+from nck.streams.json_stream import JSONStream
+from nck.utils.checksum import StreamChecksums, UploadManifest
+
+
+class TestStreamChecksums(unittest.TestCase):
+    def test_checksums_of_stream_bytes(self):
+        records = [{"id": i} for i in range(100)]
+        checksums = StreamChecksums()
+        content = JSONStream("test", iter(records)).as_file(on_bytes=checksums.update).read()
+
+        self.assertEqual(checksums.size, len(content))
+        self.assertEqual(checksums.md5_hex, hashlib.md5(content).hexdigest())
+        self.assertEqual(checksums.crc32c_base64 is None, checksums._crc32c is None)
+
+    def test_s3_etag(self):
+        content = bytes(range(256)) * 10
+        checksums = StreamChecksums(part_size=1000)
+        for i in range(0, len(content), 7):
+            checksums.update(content[i : i + 7])
+
+        parts = [content[i : i + 1000] for i in range(0, len(content), 1000)]
+        expected = hashlib.md5(b"".join(hashlib.md5(part).digest() for part in parts)).hexdigest() + "-3"
+        self.assertEqual(checksums.s3_etag(multipart_threshold=1000), expected)
+        self.assertEqual(checksums.s3_etag(multipart_threshold=10000), hashlib.md5(content).hexdigest())
+
+    def test_manifest(self):
+        checksums = StreamChecksums()
+        checksums.update(b"abc")
+        manifest = UploadManifest()
+        manifest.add("gs://bucket/file.njson", checksums)
+
+        self.assertEqual(manifest.objects[0]["uri"], "gs://bucket/file.njson")
+        self.assertEqual(manifest.objects[0]["size"], 3)
+        self.assertEqual(manifest.objects[0]["md5"], "kAFQmDzST7DWlj99KOF/cg==")
@@ -0,0 +1,58 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import unittest
+
+from nck.utils.column_stats import HyperLogLog, StreamStatistics
+
+
+class TestColumnStats(unittest.TestCase):
+    def test_hyperloglog_count(self):
+        hll = HyperLogLog()
+        for i in range(100000):
+            hll.add(i % 50000)
+        self.assertAlmostEqual(hll.count(), 50000, delta=50000 * 0.05)
+
+    def test_hyperloglog_small_count(self):
+        hll = HyperLogLog()
+        for value in ["a", "b", "c", "a"]:
+            hll.add(value)
+        self.assertEqual(hll.count(), 3)
+
+    def test_stream_statistics(self):
+        stats = StreamStatistics()
+        stats.update({"date": "2020-01-02", "clicks": 3})
+        stats.update({"date": "2020-01-01", "clicks": None})
+        stats.update({"date": "2020-01-03", "clicks": 1, "labels": ["a"]})
+
+        self.assertEqual(
+            stats.to_dict(),
+            {
+                "row_count": 3,
+                "columns": {
+                    "date": {
+                        "count": 3,
+                        "null_count": 0,
+                        "min": "2020-01-01",
+                        "max": "2020-01-03",
+                        "approx_distinct_count": 3,
+                    },
+                    "clicks": {"count": 2, "null_count": 1, "min": 1, "max": 3, "approx_distinct_count": 2},
+                    "labels": {"count": 1, "null_count": 2, "min": None, "max": None, "approx_distinct_count": 1},
+                },
+            },
+        )
@@ -0,0 +1,149 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import bz2
+import codecs
+import csv
+import gzip
+import io
+import lzma
+import unittest
+import zipfile
+from unittest import mock
+
+from nck.streams.record_batch import RecordBatch
+from nck.utils import file_reader
+from nck.utils.buffers import ReadableStream
+from nck.utils.file_reader import FileEnum
+
+CSV_DATA = b"a,b\n1,2\n3,4\n"
+RECORDS = [{"a": "1", "b": "2"}, {"a": "3", "b": "4"}]
+
+
+def read(_format, data, seekable=True, parse_workers=1):
+    reader = FileEnum[_format].value(csv_delimiter=",", csv_fieldnames=None, parse_workers=parse_workers).get_csv_reader()
+    fd = io.BytesIO(data) if seekable else io.BufferedReader(ReadableStream(io.BytesIO(data)))
+    records = []
+    for item in reader(fd):
+        records.extend(item if isinstance(item, RecordBatch) else [dict(item)])
+    return records
+
+
+class TestFileReaders(unittest.TestCase):
+    def test_csv_matches_dict_reader(self):
+        data = 'a;b;c\n1;"multi\nline";3\n\n4;5\n6;7;8;9\né;"quoted;value";\r\n'.encode("utf-8")
+        expected = list(csv.DictReader(codecs.iterdecode(io.BytesIO(data), "utf-8"), delimiter=";"))
+
+        reader = FileEnum.CSV.value(csv_delimiter=";", csv_fieldnames=None).get_csv_reader()
+        items = list(reader(io.BytesIO(data)))
+        records = [record for item in items for record in (item if isinstance(item, RecordBatch) else [item])]
+        self.assertEqual(records, expected)
+        self.assertIsInstance(items[0], RecordBatch)
+
+    def test_csv_fieldnames(self):
+        reader = FileEnum.CSV.value(csv_delimiter=",", csv_fieldnames='["x", "y"]').get_csv_reader()
+        self.assertEqual([list(batch) for batch in reader(io.BytesIO(b"1,2\n"))], [[{"x": "1", "y": "2"}]])
+
+    def test_compressed_csv(self):
+        self.assertEqual(read("BZ2", bz2.compress(CSV_DATA), seekable=False), RECORDS)
+        self.assertEqual(read("XZ", lzma.compress(CSV_DATA), seekable=False), RECORDS)
+
+    def test_njson(self):
+        data = b'{"a": "1", "b": "2"}\n\n{"a": "3", "b": "4"}\n'
+        self.assertEqual(read("NJSON", data, seekable=False), RECORDS)
+
+    def test_iter_line_blocks(self):
+        blocks = list(file_reader.iter_line_blocks(io.BytesIO(b"ab\ncdef\ng\nh"), 4))
+        self.assertEqual(blocks, [b"ab\ncdef\n", b"g\nh"])
+
+        data = b'a,"b\nc""\nd"\ne\n'
+        self.assertEqual(list(file_reader.iter_line_blocks(io.BytesIO(data), 3)), [b'a,"b\n', b'c""\n', b'd"\n', b"e\n"])
+        blocks = list(file_reader.iter_line_blocks(io.BytesIO(data), 3, quotechar=b'"'))
+        self.assertEqual(blocks, [data[:-2], b"e\n"])
+
+    @mock.patch.object(file_reader, "PARSE_BLOCK_SIZE", 10)
+    def test_parse_in_parallel(self):
+        rows = [{"a": str(i), "b": str(i * 2)} for i in range(200)]
+        data = ("a,b\n" + "".join(f"{row['a']},{row['b']}\n" for row in rows)).encode()
+        self.assertEqual(read("GZ", gzip.compress(data), seekable=False, parse_workers=3), rows)
+
+        data = "".join(f'{{"a": "{row["a"]}", "b": "{row["b"]}"}}\n' for row in rows).encode()
+        self.assertEqual(read("NJSON", data, seekable=False, parse_workers=3), rows)
+
+    @mock.patch.object(file_reader, "PARSE_BLOCK_SIZE", 10)
+    def test_parse_in_parallel_multiline_values(self):
+        rows = [{"a": f"line {i}\nline {i + 1}", "b": f'say "{i}"\r\n'} for i in range(50)]
+        text = io.StringIO(newline="")
+        writer = csv.DictWriter(text, fieldnames=["a", "b"], lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
+        data = text.getvalue().encode()
+
+        self.assertEqual(read("CSV", data, seekable=False), rows)
+        self.assertEqual(read("CSV", data, seekable=False, parse_workers=3), rows)
+
+    def test_zip(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as zip_file:
+            zip_file.writestr("folder/", b"")
+            zip_file.writestr("folder/first.csv", b"a,b\n1,2\n")
+            zip_file.writestr("second.csv", b"a,b\n3,4\n")
+            zip_file.writestr("__MACOSX/folder/._first.csv", b"\x00\x05\x16\x07")
+            zip_file.writestr("folder/.DS_Store", b"\x00\x00\x00\x01Bud1")
+            zip_file.writestr("README.md", b"# Report")
+
+        self.assertTrue(FileEnum.ZIP.value.seekable_file_required)
+        self.assertEqual(read("ZIP", archive.getvalue()), RECORDS)
+
+    @unittest.skipIf(file_reader.zstandard is None, "zstandard is not installed")
+    def test_zst(self):
+        data = file_reader.zstandard.ZstdCompressor().compress(CSV_DATA)
+        self.assertEqual(read("ZST", data, seekable=False), RECORDS)
+
+    def test_zst_without_zstandard_package(self):
+        # The decompression stream of zstandard only needs to be readable
+        fake_zstandard = mock.MagicMock()
+        fake_zstandard.ZstdDecompressor.return_value.stream_reader.side_effect = lambda fd: io.BytesIO(fd.read())
+        with mock.patch.object(file_reader, "zstandard", fake_zstandard):
+            self.assertEqual(read("ZST", CSV_DATA, seekable=False), RECORDS)
+
+        with mock.patch.object(file_reader, "zstandard", None):
+            with self.assertRaises(ImportError):
+                read("ZST", CSV_DATA)
+
+    def test_parquet_without_pyarrow_package(self):
+        fake_pq = mock.MagicMock()
+        parquet_file = fake_pq.ParquetFile.return_value
+        parquet_file.num_row_groups = 2
+        parquet_file.read_row_group.side_effect = lambda i: mock.Mock(
+            to_pydict=lambda: {"a": [RECORDS[i]["a"]], "b": [RECORDS[i]["b"]]}
+        )
+        with mock.patch.object(file_reader, "pq", fake_pq):
+            self.assertEqual(read("PARQUET", b"PAR1"), RECORDS)
+
+        with mock.patch.object(file_reader, "pq", None):
+            with self.assertRaises(ImportError):
+                read("PARQUET", b"PAR1")
+
+    @unittest.skipIf(file_reader.pq is None, "pyarrow is not installed")
+    def test_parquet(self):
+        import pyarrow
+
+        data = io.BytesIO()
+        file_reader.pq.write_table(pyarrow.table({"a": ["1", "3"], "b": ["2", "4"]}), data, row_group_size=1)
+
+        self.assertEqual(read("PARQUET", data.getvalue()), RECORDS)
@@ -18,7 +18,7 @@
 import logging
 from unittest import TestCase
 
-from nck.utils.text import parse_decoded_line, get_report_generator_from_flat_file
+from nck.utils.text import parse_decoded_line, get_report_generator_from_flat_file, get_record_batches_from_flat_file
 
 
 class TestTextUtilsMethod(TestCase):
@@ -223,3 +223,22 @@ class TestTextUtilsMethod(TestCase):
         ]
         for output_record, expected_record in zip(output, expected):
             self.assertEqual(output_record, expected_record)
+
+    def test_get_record_batches(self):
+        lines = [
+            "Date,Country,AdvertiserId,Impressions",
+            "2020-01-01,France,1234,10",
+            "2020-01-01,France,5678",
+            "2020-01-02,France,5678,20",
+            "2020-01-03,Spain,5678,30",
+        ]
+        column_dict = {"Country": "FR", "Source": "test"}
+        batches = list(
+            get_record_batches_from_flat_file(iter(lines), add_column=True, column_dict=column_dict, batch_size=2)
+        )
+
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+        self.assertEqual(
+            [record for batch in batches for record in batch],
+            list(get_report_generator_from_flat_file(iter(lines), add_column=True, column_dict=column_dict)),
+        )
@@ -0,0 +1,250 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import unittest
+from unittest import mock
+
+import click
+from google.api_core.exceptions import NotFound
+from google.cloud import bigquery
+
+from nck.streams.normalized_json_stream import NormalizedJSONStream
+from nck.writers.bigquery_writer import BigQueryWriter
+
+
+@mock.patch("nck.writers.bigquery_writer.config", PROJECT_ID="project", create=True)
+@mock.patch("nck.writers.bigquery_writer.bigquery.Client")
+@mock.patch.object(BigQueryWriter, "_get_credentials", lambda *args: None)
+class TestBigQueryWriter(unittest.TestCase):
+    kwargs = {
+        "dataset": "dataset",
+        "table": "table",
+        "partition_column": None,
+        "write_disposition": "truncate",
+        "location": "EU",
+        "keep_files": False,
+    }
+
+    @mock.patch("nck.writers.bigquery_writer.GCSWriter")
+    def test_direct_load(self, mock_gcs_writer, mock_client, mock_config):
+        mock_client.return_value.load_table_from_file.return_value.result.return_value.state = "DONE"
+        writer = BigQueryWriter(bucket=None, direct_load=True, **self.kwargs)
+        writer.write(NormalizedJSONStream("test", iter([{"a": 1}])))
+
+        file = mock_client.return_value.load_table_from_file.call_args[0][0]
+        self.assertEqual(file.read(), b'{"a": 1}\n')
+        mock_gcs_writer.assert_not_called()
+
+    def test_bucket_is_required_without_direct_load(self, mock_client, mock_config):
+        with self.assertRaises(click.BadParameter):
+            BigQueryWriter(bucket=None, **self.kwargs)
+
+    @mock.patch("nck.writers.bigquery_writer.GCSWriter")
+    def test_batch_loads(self, mock_gcs_writer, mock_client, mock_config):
+        blobs = [mock.MagicMock(), mock.MagicMock()]
+        mock_gcs_writer.return_value.write.side_effect = [("gs://bucket/a", blobs[0]), ("gs://bucket/b", blobs[1])]
+        mock_client.return_value.load_table_from_uri.return_value.result.return_value.state = "DONE"
+        writer = BigQueryWriter(bucket="bucket", batch_loads=True, **self.kwargs)
+
+        writer.write(NormalizedJSONStream("a", iter([{"a": 1}])))
+        writer.write(NormalizedJSONStream("b", iter([{"a": 2}])))
+        mock_client.return_value.load_table_from_uri.assert_not_called()
+
+        writer.close()
+        mock_client.return_value.load_table_from_uri.assert_called_once()
+        self.assertEqual(
+            mock_client.return_value.load_table_from_uri.call_args[0][0], ["gs://bucket/a", "gs://bucket/b"]
+        )
+        for blob in blobs:
+            blob.delete.assert_called_once()
+
+    @mock.patch("nck.writers.bigquery_writer.GCSWriter")
+    def test_batch_loads_split_jobs(self, mock_gcs_writer, mock_client, mock_config):
+        mock_client.return_value.load_table_from_uri.return_value.result.return_value.state = "DONE"
+        writer = BigQueryWriter(bucket="bucket", batch_loads=True, **self.kwargs)
+        writer.MAX_SOURCE_URIS = 2
+        writer._staged_blobs = [("table", "gs://bucket/{}".format(i), mock.MagicMock(), False) for i in range(5)]
+
+        writer.close()
+        calls = mock_client.return_value.load_table_from_uri.call_args_list
+        self.assertEqual([len(call[0][0]) for call in calls], [2, 2, 1])
+        self.assertEqual(calls[1][1]["job_config"].write_disposition, "WRITE_APPEND")
+
+    def test_partition_scoped_truncate(self, mock_client, mock_config):
+        load_job = mock.MagicMock()
+        load_job.result.return_value.state = "DONE"
+        contents = []
+
+        def load_table_from_file(file, table_ref, job_config):
+            # Files are uploaded as soon as their load job is created
+            contents.append(file.read())
+            return load_job
+
+        mock_client.return_value.load_table_from_file.side_effect = load_table_from_file
+        kwargs = dict(self.kwargs, partition_column="date")
+        writer = BigQueryWriter(bucket=None, direct_load=True, **kwargs)
+        records = [
+            {"date": "2020-01-02", "clicks": 1},
+            {"date": "2020-01-01", "clicks": 2},
+            {"date": "2020-01-01T10:00:00", "clicks": 3},
+        ]
+        writer.write(NormalizedJSONStream("test", iter(records)))
+
+        calls = mock_client.return_value.load_table_from_file.call_args_list
+        self.assertEqual([call[0][1].table_id for call in calls], ["table$20200101", "table$20200102"])
+        self.assertEqual(contents[0], b'{"date": "2020-01-01", "clicks": 2}\n{"date": "2020-01-01T10:00:00", "clicks": 3}\n')
+        self.assertEqual(calls[0][1]["job_config"].write_disposition, "WRITE_TRUNCATE")
+        # Both load jobs are submitted before being waited for
+        self.assertEqual(load_job.result.call_count, 2)
+
+    def test_partition_scoped_truncate_above_max_partition_loads(self, mock_client, mock_config):
+        client = mock_client.return_value
+        client.load_table_from_file.return_value.result.return_value.state = "DONE"
+        client.get_table.return_value.schema = [mock.MagicMock(), mock.MagicMock()]
+        client.get_table.return_value.schema[0].name = "date"
+        client.get_table.return_value.schema[1].name = "clicks"
+        kwargs = dict(self.kwargs, partition_column="date")
+        writer = BigQueryWriter(bucket=None, direct_load=True, **kwargs)
+        writer.MAX_PARTITION_LOAD_JOBS = 1
+        writer.write(NormalizedJSONStream("test", iter([{"date": "2020-01-01"}, {"date": "2020-01-02"}])))
+
+        client.load_table_from_file.assert_called_once()
+        staging_ref = client.load_table_from_file.call_args[0][1]
+        self.assertTrue(staging_ref.table_id.startswith("table_staging_"))
+        query = client.query.call_args[0][0]
+        self.assertIn("DELETE FROM `project.dataset.table` WHERE DATE(`date`) IN", query)
+        self.assertIn("INSERT INTO `project.dataset.table` (`date`, `clicks`) SELECT `date`, `clicks` FROM", query)
+        client.delete_table.assert_called_once_with(staging_ref, not_found_ok=True)
+
+    def test_partition_column_with_append(self, mock_client, mock_config):
+        mock_client.return_value.load_table_from_file.return_value.result.return_value.state = "DONE"
+        kwargs = dict(self.kwargs, partition_column="date", write_disposition="append")
+        writer = BigQueryWriter(bucket=None, direct_load=True, **kwargs)
+        writer.write(NormalizedJSONStream("test", iter([{"date": "2020-01-01"}, {"date": "2020-01-02"}])))
+
+        table_ref = mock_client.return_value.load_table_from_file.call_args[0][1]
+        self.assertEqual(table_ref.table_id, "table")
+
+    def test_merge_query(self, mock_client, mock_config):
+        writer = BigQueryWriter(bucket=None, direct_load=True, merge_key=("id",), **self.kwargs)
+        query = writer.merge_query(["id", "name"])
+
+        # Rows sharing a key make the merge fail, rather than one of them being picked arbitrarily
+        self.assertTrue(query.startswith("ASSERT NOT EXISTS (SELECT 1 FROM `project.dataset.table_staging_"))
+        self.assertIn("GROUP BY `id` HAVING COUNT(*) > 1)", query)
+        self.assertIn("; MERGE `project.dataset.table` T USING `project.dataset.table_staging_", query)
+        self.assertIn("ON T.`id` = S.`id`", query)
+        self.assertIn("WHEN MATCHED THEN UPDATE SET `name` = S.`name`", query)
+        self.assertIn("WHEN NOT MATCHED THEN INSERT (`id`, `name`) VALUES (`id`, `name`)", query)
+
+    def test_merge_query_with_order_by(self, mock_client, mock_config):
+        writer = BigQueryWriter(
+            bucket=None, direct_load=True, merge_key=("id",), merge_order_by=("updated_at",), **self.kwargs
+        )
+        query = writer.merge_query(["id", "name", "updated_at"])
+
+        self.assertTrue(
+            query.startswith("MERGE `project.dataset.table` T USING (SELECT * FROM `project.dataset.table_staging_")
+        )
+        self.assertIn("QUALIFY ROW_NUMBER() OVER (PARTITION BY `id` ORDER BY `updated_at` DESC) = 1) S", query)
+
+    def test_merge_order_by_requires_merge_key(self, mock_client, mock_config):
+        with self.assertRaises(click.BadParameter):
+            BigQueryWriter(bucket=None, direct_load=True, merge_order_by=("updated_at",), **self.kwargs)
+
+    def test_merge_into_missing_table(self, mock_client, mock_config):
+        client = mock_client.return_value
+        staging = mock.Mock(schema=[bigquery.SchemaField("id", "INTEGER")], time_partitioning=None)
+        client.get_table.side_effect = [staging, NotFound("table")]
+        writer = BigQueryWriter(bucket=None, direct_load=True, merge_key=("id",), **self.kwargs)
+        writer._merge()
+
+        # The table is created empty, then merged into, so that duplicated keys are handled the same way
+        self.assertEqual(client.create_table.call_args[0][0].schema, staging.schema)
+        self.assertIn("MERGE", client.query.call_args[0][0])
+        client.copy_table.assert_not_called()
+        client.delete_table.assert_called_once()
+
+    def test_merge_load(self, mock_client, mock_config):
+        client = mock_client.return_value
+        client.load_table_from_file.return_value.result.return_value.state = "DONE"
+        client.get_table.return_value.schema = [mock.Mock(), mock.Mock()]
+        client.get_table.return_value.schema[0].name = "id"
+        client.get_table.return_value.schema[1].name = "name"
+        writer = BigQueryWriter(bucket=None, direct_load=True, merge_key=("id",), **self.kwargs)
+        writer.write(NormalizedJSONStream("test", iter([{"id": 1, "name": "a"}])))
+
+        self.assertTrue(client.load_table_from_file.call_args[0][1].table_id.startswith("table_staging_"))
+        self.assertIn("MERGE", client.query.call_args[0][0])
+        client.delete_table.assert_called_once()
+
+    def test_merge_columns_follow_destination_schema(self, mock_client, mock_config):
+        client = mock_client.return_value
+
+        def get_table(table_ref):
+            is_staging_table = table_ref.table_id.startswith("table_staging_")
+            names = ["id", "name", "new_column"] if is_staging_table else ["id", "name", "old_column"]
+            table = mock.Mock(schema=[mock.Mock() for _ in names])
+            for field, name in zip(table.schema, names):
+                field.name = name
+            return table
+
+        client.get_table.side_effect = get_table
+        writer = BigQueryWriter(bucket=None, direct_load=True, merge_key=("id",), **self.kwargs)
+        writer._merge()
+
+        query = client.query.call_args[0][0]
+        self.assertIn("INSERT (`id`, `name`) VALUES (`id`, `name`)", query)
+        self.assertNotIn("column", query)
+
+    @mock.patch("nck.writers.bigquery_writer.GCSWriter")
+    def test_skip_unchanged(self, mock_gcs_writer, mock_client, mock_config):
+        blob = mock.MagicMock(metadata={"nck-loaded-into": "project.dataset.table"})
+        mock_gcs_writer.return_value.write.return_value = ("gs://bucket/dataset/table_0.njson", blob)
+        mock_gcs_writer.return_value.skipped_uris = ["gs://bucket/dataset/table_0.njson"]
+        writer = BigQueryWriter(bucket="bucket", skip_unchanged=True, **dict(self.kwargs, write_disposition="append"))
+        writer.write(NormalizedJSONStream("test", iter([{"a": 1}])))
+
+        mock_gcs_writer.assert_called_once_with(
+            "bucket", "project", prefix="dataset", file_name="table_0", skip_unchanged=True
+        )
+        mock_client.return_value.load_table_from_uri.assert_not_called()
+
+    @mock.patch("nck.writers.bigquery_writer.GCSWriter")
+    def test_unchanged_file_is_loaded_until_its_load_succeeds(self, mock_gcs_writer, mock_client, mock_config):
+        blob = mock.MagicMock(metadata=None)
+        mock_gcs_writer.return_value.write.return_value = ("gs://bucket/dataset/table_0.njson", blob)
+        mock_gcs_writer.return_value.skipped_uris = ["gs://bucket/dataset/table_0.njson"]
+        mock_client.return_value.load_table_from_uri.return_value.result.return_value.state = "DONE"
+        writer = BigQueryWriter(bucket="bucket", skip_unchanged=True, **dict(self.kwargs, write_disposition="append"))
+        writer.write(NormalizedJSONStream("test", iter([{"a": 1}])))
+
+        mock_client.return_value.load_table_from_uri.assert_called_once()
+        self.assertEqual(blob.metadata, {"nck-loaded-into": "project.dataset.table"})
+        blob.patch.assert_called_once()
+        blob.delete.assert_not_called()
+
+    @mock.patch("nck.writers.bigquery_writer.GCSWriter")
+    def test_skip_unchanged_is_disabled_with_truncate(self, mock_gcs_writer, mock_client, mock_config):
+        mock_gcs_writer.return_value.write.return_value = ("gs://bucket/table.njson", mock.MagicMock())
+        mock_client.return_value.load_table_from_uri.return_value.result.return_value.state = "DONE"
+        with self.assertLogs(level="WARNING"):
+            writer = BigQueryWriter(bucket="bucket", skip_unchanged=True, **self.kwargs)
+        writer.write(NormalizedJSONStream("test", iter([{"a": 1}])))
+
+        mock_gcs_writer.assert_called_once_with("bucket", "project")
+        mock_client.return_value.load_table_from_uri.assert_called_once()
@@ -15,7 +15,15 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import io
 import unittest
+from unittest import mock
+
+import click
+from requests.exceptions import ConnectionError
+from nck.utils.checksum import StreamChecksums
+from nck.utils.exceptions import ChecksumMismatchError
+from nck.streams.json_stream import JSONStream
 from nck.writers.gcs_writer import GCSWriter
 
 
@@ -24,3 +32,146 @@ class TestGCSWriter(unittest.TestCase):
         filename = "test.py"
         print(GCSWriter._extract_extension(filename))
         assert GCSWriter._extract_extension(filename) == ("test", ".py")
+
+    def test_validate_checksums(self):
+        checksums = StreamChecksums()
+        checksums.update(b"abc")
+        blob = mock.MagicMock(md5_hash="kAFQmDzST7DWlj99KOF/cg==", crc32c=None)
+        GCSWriter.validate_checksums(blob, checksums)
+
+        blob.md5_hash = "AAAAAAAAAAAAAAAAAAAAAA=="
+        with self.assertRaises(ChecksumMismatchError):
+            GCSWriter.validate_checksums(blob, checksums)
+
+
+class FakeUploadSession:
+    """GCS resumable upload session, whose second chunk fails once, after half of it is committed."""
+
+    def __init__(self, committed=b""):
+        self.committed = committed
+        self.chunks = 0
+        self.failed = False
+
+    def put(self, url, data=b"", headers=None, timeout=None):
+        byte_range, total = headers["Content-Range"].split(" ")[1].split("/")
+        if byte_range != "*":
+            assert int(byte_range.split("-")[0]) == len(self.committed)
+            self.chunks += 1
+            if self.chunks == 2 and not self.failed:
+                self.failed = True
+                self.committed += data[: len(data) // 2]
+                raise ConnectionError("Connection reset")
+            self.committed += data
+        if total != "*" and int(total) == len(self.committed):
+            return mock.MagicMock(status_code=200)
+        headers = {"Range": "bytes=0-{}".format(len(self.committed) - 1)} if self.committed else {}
+        return mock.MagicMock(status_code=308, headers=headers)
+
+
+@mock.patch("nck.writers.gcs_writer.storage.Client")
+@mock.patch.object(GCSWriter, "_get_credentials", lambda *args: None)
+class TestGCSWriterUploads(unittest.TestCase):
+    data = bytes(range(256)) * 40
+
+    def upload_resumable(self, session, data=None):
+        writer = GCSWriter("bucket", "project", chunk_size_mb=1)
+        writer._chunk_size = 1000
+        blob = mock.MagicMock()
+        blob.name = "file.njson"
+        blob.create_resumable_upload_session.return_value = "https://fake-upload-session"
+        with mock.patch("nck.writers.gcs_writer.requests.put", side_effect=session.put):
+            writer.upload_resumable(blob, io.BytesIO(self.data if data is None else data), "application/json")
+        return blob
+
+    def test_upload_resumable_resumes_after_failure(self, mock_client):
+        session = FakeUploadSession()
+        blob = self.upload_resumable(session)
+
+        self.assertTrue(session.failed)
+        self.assertEqual(session.committed, self.data)
+        blob.reload.assert_called_once()
+
+    def test_upload_resumable_never_resumes_session_of_previous_run(self, mock_client):
+        first_run = FakeUploadSession()
+        first_run.put = mock.MagicMock(side_effect=ConnectionError("Connection reset"))
+        with self.assertRaises(ConnectionError):
+            self.upload_resumable(first_run)
+
+        # The next run generates a different content, which must not be appended to the bytes of the first one
+        second_run = FakeUploadSession()
+        data = bytes(reversed(self.data))
+        blob = self.upload_resumable(second_run, data)
+
+        blob.create_resumable_upload_session.assert_called_once()
+        self.assertEqual(second_run.committed, data)
+
+    def test_upload_requests_have_a_timeout(self, mock_client):
+        session = FakeUploadSession()
+        with mock.patch.object(session, "put", wraps=session.put) as put:
+            self.upload_resumable(session)
+        self.assertTrue(all(call[1]["timeout"] for call in put.call_args_list))
+
+    @mock.patch("nck.writers.gcs_writer.MAX_COMPOSE_SOURCES", 4)
+    def test_upload_composite(self, mock_client):
+        writer = GCSWriter("bucket", "project", parallel_uploads=3)
+        writer._chunk_size = 1000
+        blobs = {}
+
+        def create_blob(name):
+            blobs[name] = mock.MagicMock()
+            blobs[name].name = name
+            return blobs[name]
+
+        writer._bucket.blob.side_effect = create_blob
+        blob = mock.MagicMock()
+        blob.name = "file.njson"
+        writer.upload_composite(blob, io.BytesIO(self.data), "application/json")
+
+        parts = [blobs["file.njson.part-{:05d}".format(i)] for i in range(11)]
+        uploaded = b"".join(part.upload_from_string.call_args[0][0] for part in parts)
+        self.assertEqual(uploaded, self.data)
+        self.assertEqual(blobs["file.njson.compose-0-00000"].compose.call_args[0][0], parts[:4])
+        self.assertEqual(len(blob.compose.call_args[0][0]), 3)
+        for temporary_blob in blobs.values():
+            temporary_blob.delete.assert_called_once()
+
+    def test_upload_composite_deletes_parts_on_failure(self, mock_client):
+        writer = GCSWriter("bucket", "project", parallel_uploads=3)
+        writer._chunk_size = 1000
+        blob = mock.MagicMock()
+        blob.compose.side_effect = ConnectionError("Connection reset")
+
+        with self.assertRaises(ConnectionError):
+            writer.upload_composite(blob, io.BytesIO(self.data), "application/json")
+        self.assertEqual(writer._bucket.blob.return_value.delete.call_count, 11)
+
+    def test_skip_unchanged(self, mock_client):
+        writer = GCSWriter("bucket", "project", file_name="report", skip_unchanged=True)
+        uploaded = []
+        writer.upload_resumable = mock.MagicMock(side_effect=lambda blob, file, content_type: uploaded.append(file.read()))
+        writer.validate_checksums = mock.MagicMock()
+        checksums = StreamChecksums()
+        checksums.update(b'{"a": 1}\n')
+        writer._bucket.get_blob.return_value.md5_hash = checksums.md5_base64
+
+        uri, _ = writer.write(JSONStream("report", iter([{"a": 1}])))
+        writer.upload_resumable.assert_not_called()
+        self.assertEqual(writer.skipped_uris, [uri])
+
+        writer.write(JSONStream("report", iter([{"a": 2}])))
+        writer.upload_resumable.assert_called_once()
+        self.assertEqual(uploaded, [b'{"a": 2}\n'])
+
+    def test_skip_unchanged_requires_file_name(self, mock_client):
+        with self.assertRaises(click.BadParameter):
+            GCSWriter("bucket", "project", skip_unchanged=True)
+
+    def test_is_unchanged_composite_blob(self, mock_client):
+        writer = GCSWriter("bucket", "project")
+        checksums = StreamChecksums()
+        checksums.update(b"abc")
+        writer._bucket.get_blob.return_value = None
+        self.assertFalse(writer.is_unchanged(mock.MagicMock(), checksums))
+
+        writer._bucket.get_blob.return_value = mock.MagicMock(md5_hash=None, crc32c=checksums.crc32c_base64)
+        self.assertEqual(writer.is_unchanged(mock.MagicMock(), checksums), checksums.crc32c_base64 is not None)
@@ -0,0 +1,68 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import json
+import os
+import tempfile
+import unittest
+
+from nck.streams.json_stream import JSONStream
+from nck.writers.local_writer import LocalWriter, UMASK
+
+
+class TestLocalWriter(unittest.TestCase):
+    def test_write_with_stats(self):
+        records = [{"date": "2020-01-01", "clicks": 1}, {"date": "2020-01-02", "clicks": 2}]
+        with tempfile.TemporaryDirectory() as directory:
+            LocalWriter(directory, "report.njson", local_write_stats=True).write(JSONStream("report", iter(records)))
+
+            with open(os.path.join(directory, "report.njson")) as f:
+                self.assertEqual([json.loads(line) for line in f], records)
+            with open(os.path.join(directory, "report.njson.stats.json")) as f:
+                stats = json.load(f)
+            self.assertEqual(stats["row_count"], 2)
+            self.assertEqual(stats["columns"]["date"]["max"], "2020-01-02")
+
+    def test_write_is_atomic(self):
+        def records():
+            yield {"a": 1}
+            raise ValueError("Extraction failed")
+
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, "report.njson"), "w") as f:
+                f.write("previous")
+            with self.assertRaises(ValueError):
+                LocalWriter(directory, "report.njson", local_fsync=True).write(JSONStream("report", records()))
+
+            self.assertEqual(os.listdir(directory), ["report.njson"])
+            with open(os.path.join(directory, "report.njson")) as f:
+                self.assertEqual(f.read(), "previous")
+
+    def test_write_large_stream(self):
+        records = [{"index": i} for i in range(10000)]
+        with tempfile.TemporaryDirectory() as directory:
+            LocalWriter(directory, "report.njson", local_buffer_size_mb=1).write(JSONStream("report", iter(records)))
+
+            with open(os.path.join(directory, "report.njson")) as f:
+                self.assertEqual([json.loads(line) for line in f], records)
+
+    def test_written_files_follow_umask(self):
+        with tempfile.TemporaryDirectory() as directory:
+            LocalWriter(directory, "report.njson").write(JSONStream("report", iter([{"a": 1}])))
+
+            mode = os.stat(os.path.join(directory, "report.njson")).st_mode & 0o777
+            self.assertEqual(mode, 0o666 & ~UMASK)
@@ -0,0 +1,86 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import unittest
+from unittest import mock
+
+import click
+
+from botocore.exceptions import ClientError
+
+from nck.utils.checksum import StreamChecksums
+from nck.utils.exceptions import ChecksumMismatchError
+from nck.writers.s3_writer import S3Writer
+
+
+@mock.patch("nck.writers.s3_writer.boto3.resource")
+class TestS3Writer(unittest.TestCase):
+    def test_bucket_checks_are_cached(self, mock_resource):
+        client = mock_resource.return_value.meta.client
+        client.get_bucket_location.return_value = {"LocationConstraint": "eu-west-3"}
+        writer = S3Writer("bucket", "key", "secret", "eu-west-3", filename=None)
+
+        self.assertIs(writer.get_bucket(), writer.get_bucket())
+        client.head_bucket.assert_called_once_with(Bucket="bucket")
+        client.get_bucket_location.assert_called_once_with(Bucket="bucket")
+        mock_resource.return_value.create_bucket.assert_not_called()
+        mock_resource.return_value.buckets.all.assert_not_called()
+
+    def test_missing_bucket_is_created(self, mock_resource):
+        client = mock_resource.return_value.meta.client
+        client.head_bucket.side_effect = ClientError({"Error": {"Code": "404"}}, "HeadBucket")
+        client.get_bucket_location.return_value = {"LocationConstraint": "eu-west-3"}
+        S3Writer("bucket", "key", "secret", "eu-west-3", filename=None).get_bucket()
+
+        mock_resource.return_value.create_bucket.assert_called_once_with(
+            Bucket="bucket", CreateBucketConfiguration={"LocationConstraint": "eu-west-3"}
+        )
+
+    def test_transfer_config(self, mock_resource):
+        writer = S3Writer("bucket", "key", "secret", "eu-west-3", multipart_chunksize_mb=16, max_concurrency=4)
+
+        self.assertEqual(writer._transfer_config.multipart_chunksize, 16 * 1024 * 1024)
+        self.assertEqual(writer._transfer_config.max_concurrency, 4)
+        self.assertEqual(writer._transfer_config.max_in_memory_upload_chunks, 8)
+
+    def test_skip_unchanged_requires_filename(self, mock_resource):
+        with self.assertRaises(click.BadParameter):
+            S3Writer("bucket", "key", "secret", "eu-west-3", filename=None, skip_unchanged=True)
+
+    def test_validate_checksums(self, mock_resource):
+        checksums = StreamChecksums(part_size=2)
+        checksums.update(b"abc")
+        _object = mock.MagicMock(server_side_encryption=None, e_tag='"900150983cd24fb0d6963f7d28e17f72"')
+        S3Writer.validate_checksums(_object, checksums, multipart_threshold=10)
+
+        with self.assertRaises(ChecksumMismatchError):
+            S3Writer.validate_checksums(_object, checksums, multipart_threshold=2)
+
+    def test_is_unchanged(self, mock_resource):
+        writer = S3Writer("bucket", "key", "secret", "eu-west-3", multipart_chunksize_mb=8)
+        checksums = StreamChecksums()
+        checksums.update(b"abc")
+
+        _object = mock.MagicMock(metadata={"nck-md5": "900150983cd24fb0d6963f7d28e17f72"})
+        self.assertTrue(writer.is_unchanged(_object, checksums))
+
+        _object = mock.MagicMock(metadata={}, server_side_encryption=None, e_tag='"00000000000000000000000000000000"')
+        self.assertFalse(writer.is_unchanged(_object, checksums))
+
+        _object = mock.MagicMock()
+        _object.load.side_effect = ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        self.assertFalse(writer.is_unchanged(_object, checksums))
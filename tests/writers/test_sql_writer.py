@@ -0,0 +1,97 @@
+# GNU Lesser General Public License v3.0 only
+# Copyright (C) 2020 Artefact
+# licence-information@artefact.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import datetime
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import click
+import sqlalchemy
+from sqlalchemy.dialects import postgresql
+
+from nck.streams.json_stream import JSONStream
+from nck.writers.sql_writer import SQLWriter, infer_column_type
+
+
+class TestSQLWriter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.directory.name, "test.db")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def execute(self, query):
+        engine = sqlalchemy.create_engine("sqlite:///{}".format(self.database))
+        with engine.begin() as connection:
+            result = connection.execute(sqlalchemy.text(query))
+            rows = [tuple(row) for row in result] if result.returns_rows else None
+        engine.dispose()
+        return rows
+
+    def test_write_creates_table(self):
+        records = [
+            {"date": datetime.date(2020, 1, 1), "clicks": 1, "cost": 1.5, "tags": ["a"]},
+            {"date": datetime.date(2020, 1, 2), "clicks": 2, "cost": None, "tags": []},
+            {"date": datetime.date(2020, 1, 3), "clicks": 3, "cost": 2},
+        ]
+        writer = SQLWriter("sqlite", self.database, "report", batch_size=2)
+        writer.write(JSONStream("report", iter(records)))
+        writer.close()
+
+        self.assertEqual(
+            self.execute("SELECT date, clicks, cost, tags FROM report ORDER BY clicks"),
+            [("2020-01-01", 1, 1.5, '["a"]'), ("2020-01-02", 2, None, "[]"), ("2020-01-03", 3, 2.0, None)],
+        )
+
+    def test_write_appends_to_existing_table(self):
+        self.execute("CREATE TABLE report (id INTEGER, name TEXT)")
+        writer = SQLWriter("sqlite", self.database, "report")
+        writer.write(JSONStream("first", iter([{"id": 1, "name": "a", "unknown": "x"}])))
+        writer.write(JSONStream("second", iter([{"id": 2}])))
+        writer.close()
+
+        self.assertEqual(self.execute("SELECT id, name FROM report ORDER BY id"), [(1, "a"), (2, None)])
+
+    def test_bulk_requires_supported_dialect(self):
+        with self.assertRaises(click.BadParameter):
+            SQLWriter("sqlite", self.database, "report", load_method="bulk")
+
+    def test_infer_column_type(self):
+        self.assertIs(infer_column_type([1, None, 2]), sqlalchemy.BigInteger)
+        self.assertIs(infer_column_type([1, 2.5]), sqlalchemy.Float)
+        self.assertIs(infer_column_type([True, False]), sqlalchemy.Boolean)
+        self.assertIs(infer_column_type(["a", 1]), sqlalchemy.Text)
+        self.assertIs(infer_column_type([None]), sqlalchemy.Text)
+
+    def test_mysql_value(self):
+        self.assertEqual(
+            [SQLWriter._mysql_value(value) for value in [None, True, "a\\b", 1.5]], ["\\N", 1, "a\\\\b", 1.5]
+        )
+
+    def test_postgresql_copy(self):
+        table = sqlalchemy.Table("report", sqlalchemy.MetaData(schema="public"), sqlalchemy.Column("user"))
+        connection = mock.MagicMock(dialect=postgresql.dialect())
+        cursor = connection.connection.cursor.return_value.__enter__.return_value
+        SQLWriter._copy_rows(connection, table, ["user"], [["a,b"], [None], ["\\N"], ['say "hi"'], [1.5]])
+
+        statement, buffer = cursor.copy_expert.call_args[0]
+        self.assertEqual(statement, "COPY public.report (\"user\") FROM STDIN WITH (FORMAT csv, NULL '\\N')")
+        # Only the unquoted marker is read as NULL
+        self.assertEqual(buffer.read(), '"a,b"\n\\N\n"\\N"\n"say ""hi"""\n"1.5"\n')